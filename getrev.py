@@ -3,48 +3,331 @@
 # Simple script to pull a specific revision from a dump file
 
 import argparse
+import io
+import mmap
 import os
+import re
+import struct
 import sys
 
 
+REVISION_HEADER = b'Revision-number: '
+REVISION_PREFIX = b'\n' + REVISION_HEADER
+CONTENT_LENGTH_HEADER = b'Content-length: '
+REVISION_RE = re.compile(re.escape(REVISION_PREFIX) + rb'(\d+)\n')
+
+"""The number of bytes copied to the output at a time."""
+COPY_CHUNK_SIZE = 1 << 20
+
+"""The number of bytes read at a time when scanning a dump file that cannot be mapped."""
+SCAN_CHUNK_SIZE = 1 << 22
+
+"""Size of the region of the dump file left to be scanned once bisecting stops."""
+BISECT_WINDOW = 1 << 20
+
+"""The buffer size used when reading the dump file."""
+READ_BUFFER_SIZE = 1 << 20
+
+"""Suffix and layout of the revision index stored next to a dump file: the size of the dump file, then its entries."""
+INDEX_SUFFIX = '.ridx'
+INDEX_HEADER = struct.Struct('<Q')
+INDEX_ENTRY = struct.Struct('<QQ')
+
+
+def revision_digits(revision):
+    """
+    Returns the revision number as the ASCII digits used in a dump file.
+    """
+    return '{0}'.format(revision).encode('ascii')
+
+
+def record_end(mm, start):
+    """
+    Returns the offset just past the record starting at start: the start of the next
+    revision record, or the end of the file.
+    """
+    end = mm.find(REVISION_PREFIX, start)
+    if end < 0:
+        return len(mm)
+    return end + 1
+
+
+def locate_revision(mm, revision):
+    """
+    Bisects the mapped dump file on the revision numbers of its records, relying on revisions
+    being dumped in increasing order.
+    Returns an offset at or before the start of the revision record, within BISECT_WINDOW bytes
+    of the last record found to precede it.
+    """
+    # Digit strings without leading zeros order like their numbers once shorter strings sort first
+    digits = revision_digits(revision)
+    target = (len(digits), digits)
+    lo = 0
+    hi = len(mm)
+    while hi - lo > BISECT_WINDOW:
+        mid = (lo + hi) // 2
+        match = REVISION_RE.search(mm, mid, hi)
+        if match and (len(match.group(1)), match.group(1)) < target:
+            lo = match.start()
+        else:
+            hi = mid
+    return lo
+
+
+def find_revision(mm, revision):
+    """
+    Locates the revision record in the mapped dump file.
+    Returns the (start, end) offsets of the record, or None when the revision is not present.
+    """
+    needle = REVISION_PREFIX + revision_digits(revision) + b'\n'
+    lower_bound = locate_revision(mm, revision)
+    start = mm.find(needle, lower_bound)
+    if start < 0 and lower_bound:
+        # Revision numbers were not in increasing order, search the whole file
+        start = mm.find(needle)
+    if start < 0:
+        return None
+    start += 1
+    return start, record_end(mm, start + len(needle) - 1)
+
+
+def build_index(mm, index_file):
+    """
+    Writes an index of (revision number, record offset) entries sorted by revision number,
+    after the size of the dump file they were read from.
+    """
+    entries = [(int(match.group(1)), match.start() + 1) for match in REVISION_RE.finditer(mm)]
+    entries.sort()
+    with open(index_file, 'wb') as fd:
+        fd.write(INDEX_HEADER.pack(len(mm)))
+        for entry in entries:
+            fd.write(INDEX_ENTRY.pack(*entry))
+
+
+def index_dump_size(index_file):
+    """
+    Returns the size of the dump file the index was built from, or None when the index has no header.
+    """
+    with open(index_file, 'rb') as fd:
+        header = fd.read(INDEX_HEADER.size)
+    if len(header) < INDEX_HEADER.size:
+        return None
+    return INDEX_HEADER.unpack(header)[0]
+
+
+def lookup_index(index_file, revision):
+    """
+    Binary searches the index for the revision.
+    Returns the offset of the revision record, or None when the revision is not present.
+    """
+    with open(index_file, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size < INDEX_HEADER.size + INDEX_ENTRY.size:
+            return None
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            lo = 0
+            hi = (len(index) - INDEX_HEADER.size) // INDEX_ENTRY.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                number, offset = INDEX_ENTRY.unpack_from(index, INDEX_HEADER.size + mid * INDEX_ENTRY.size)
+                if number < revision:
+                    lo = mid + 1
+                elif number > revision:
+                    hi = mid
+                else:
+                    return offset
+    return None
+
+
+def index_points_at(mm, start, revision):
+    """
+    Whether the offset taken from the index is the start of the revision record in the mapped dump file.
+    """
+    needle = REVISION_HEADER + revision_digits(revision) + b'\n'
+    return 0 <= start < len(mm) and mm[start:start + len(needle)] == needle
+
+
+def find_revision_indexed(mm, revision, dump_file):
+    """
+    Locates the revision record using the index stored next to the dump file, building the index
+    first when it is missing, older than the dump file or built from a dump file of another size.
+    The index is built again when the offset it gives is not the start of the revision record,
+    as a dump file replaced along with its modification time looks up to date.
+    Returns the (start, end) offsets of the record, or None when the revision is not present.
+    """
+    index_file = dump_file + INDEX_SUFFIX
+    try:
+        if (not os.path.exists(index_file) or os.path.getmtime(index_file) < os.path.getmtime(dump_file) or
+                index_dump_size(index_file) != len(mm)):
+            build_index(mm, index_file)
+        start = lookup_index(index_file, revision)
+        if start is not None and not index_points_at(mm, start, revision):
+            build_index(mm, index_file)
+            start = lookup_index(index_file, revision)
+    except OSError as error:
+        sys.stderr.write('Unable to use index {0}: {1}\n'.format(index_file, error))
+        return find_revision(mm, revision)
+    if start is None:
+        return None
+    return start, record_end(mm, start + len(REVISION_HEADER))
+
+
+def copy_bytes(fd, out, length):
+    """
+    Copies length bytes from fd to out in chunks so the record is never held in memory in full.
+    """
+    while length > 0:
+        chunk = fd.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        out.write(chunk)
+        length -= len(chunk)
+
+
+def write_revision(fd, mm, start, end, out):
+    """
+    Writes the record between start and end to out. Where the platform and out allow it the bytes
+    are moved in the kernel with sendfile(); anything left is written from the mapping in chunks.
+    """
+    offset = start
+    try:
+        out_fd = out.fileno() if hasattr(os, 'sendfile') else None
+    except (AttributeError, io.UnsupportedOperation):
+        out_fd = None
+    if out_fd is not None:
+        out.flush()
+        try:
+            while offset < end:
+                sent = os.sendfile(out_fd, fd.fileno(), offset, end - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            pass  # Copy whatever was not sent
+    with memoryview(mm) as view:
+        for chunk_start in range(offset, end, COPY_CHUNK_SIZE):
+            out.write(view[chunk_start:min(chunk_start + COPY_CHUNK_SIZE, end)])
+
+
+class PrefixedReader(object):
+
+    """
+    Reads from already consumed bytes first and then from the underlying file.
+    """
+
+    def __init__(self, prefix, fd):
+        self.prefix = prefix
+        self.fd = fd
+
+    def readline(self):
+        """ Semantics of readline() across the prefix and the file. """
+        if not self.prefix:
+            return self.fd.readline()
+        end = self.prefix.find(b'\n') + 1
+        if end:
+            line = self.prefix[:end]
+            self.prefix = self.prefix[end:]
+            return line
+        line = self.prefix + self.fd.readline()
+        self.prefix = b''
+        return line
+
+    def read(self, size):
+        """ Semantics of read() across the prefix and the file. """
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        if len(data) < size:
+            data += self.fd.read(size - len(data))
+        return data
+
+
+def skip_to_revision(fd, revision):
+    """
+    Reads the dump file in large chunks until the revision record is found.
+    Returns the bytes read from the start of the record onwards, or None when the revision is not present.
+    """
+    needle = REVISION_PREFIX + revision_digits(revision) + b'\n'
+    carry = b'\n'  # Lets a record at the very start of the file match
+    while True:
+        chunk = fd.read(SCAN_CHUNK_SIZE)
+        if not chunk:
+            return None
+        buf = carry + chunk
+        pos = buf.find(needle)
+        if pos >= 0:
+            return buf[pos + 1:]
+        # Keep enough of the tail to match a needle split across two chunks
+        carry = buf[-(len(needle) - 1):]
+
+
+def read_revision(fd, revision, out):
+    """
+    Streams the revision record from a dump file that cannot be mapped, such as a pipe, to out.
+    The record is located with a chunked scan. Its header lines are then copied line by line and
+    its bodies are copied in bulk using their Content-length.
+    Returns True when the revision was found.
+    """
+    rest = skip_to_revision(fd, revision)
+    if rest is None:
+        return False
+    reader = PrefixedReader(rest, fd)
+    out.write(reader.readline())
+    content_length = 0
+    line = reader.readline()
+    while line and not line.startswith(REVISION_HEADER):
+        if line.startswith(CONTENT_LENGTH_HEADER):
+            content_length = int(line[len(CONTENT_LENGTH_HEADER):])
+        out.write(line)
+        if line == b'\n' and content_length:
+            # End of the headers, the body follows
+            copy_bytes(reader, out, content_length)
+            content_length = 0
+        line = reader.readline()
+    return True
+
+
+def advise(fd, offset, length, advice):
+    """
+    Passes an access pattern hint for the file to the kernel where supported.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd.fileno(), offset, length, getattr(os, advice))
+        except OSError:
+            pass  # Pipes do not accept hints
+
+
 def main():
 
     parser = argparse.ArgumentParser(description='Dump a revision record from a svn dump file')
     parser.add_argument('-f', '--file', dest='dump_file', required=True, type=str, help='The svn dump file to pull the revision from.')
     parser.add_argument('-r', '--revision', dest='revision', required=True, type=int, help='The revision to pull from the dump file.')
+    parser.add_argument('-i', '--index', dest='index', action='store_true', default=False,
+                        help='Use (and build when needed) a revision index stored next to the dump file to speed up repeated lookups.')
     args = parser.parse_args()
-    revision_locator = 'Revision-number: {0}'.format(args.revision)
-    with open(args.dump_file, 'rb') as fd:
-        line = fd.readline().decode()
-        buffer = []
-        in_revision = False
-        binary = False
-        while line:
-            if in_revision:
-                if binary:
-                    buffer.append((binary, line))
-                elif line.startswith('Revision-number:'):
-                    break
-                else:
-                    buffer.append((binary, line))
-            if not binary and line.startswith('Revision-number:'):
-                if line.startswith(revision_locator):
-                    buffer.append((binary, line))
-                    in_revision = True
-            next_line = fd.readline()
-            try:
-                line = next_line.decode()
-                binary = False
-            except UnicodeDecodeError:
-                line = next_line
-                binary = True
-        with os.fdopen(sys.stdout.fileno(), 'wb', closefd=False) as stdout:
-            for binary, revision_line in buffer:
-                if binary:
-                    stdout.write(revision_line)
+    out = sys.stdout.buffer
+    with open(args.dump_file, 'rb', buffering=READ_BUFFER_SIZE) as fd:
+        if not args.index:
+            advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        try:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Pipes and empty files cannot be mapped
+            found = read_revision(fd, args.revision, out)
+        else:
+            with mm:
+                if args.index:
+                    location = find_revision_indexed(mm, args.revision, args.dump_file)
                 else:
-                    stdout.write(revision_line.encode())
-            stdout.flush()
+                    location = find_revision(mm, args.revision)
+                found = location is not None
+                if found:
+                    write_revision(fd, mm, location[0], location[1], out)
+            if found:
+                # The scanned pages will not be needed again
+                advise(fd, 0, location[1], 'POSIX_FADV_DONTNEED')
+        out.flush()
+        if not found:
+            sys.exit(1)
 
 
 if __name__ == '__main__':
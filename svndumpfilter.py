@@ -2,12 +2,19 @@
 
 from argparse import ArgumentParser
 from argparse import REMAINDER as argparse_remainder
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from logging.handlers import MemoryHandler
+import mmap
 import os
 from pathlib import Path
 import pprint
 import re
 import subprocess
 import sys
+import threading
 from tempfile import TemporaryFile
 import time
 
@@ -76,6 +83,39 @@ and save the result to 'output_name.dump'.
 """The number of bytes taken by the entire self-generated property section."""
 PROPERTY_BYTES = 48
 
+"""The number of bytes copied at a time when a record body is copied through Python."""
+COPY_CHUNK_SIZE = 1 << 20
+
+"""The size from which a record body is copied with sendfile() instead of through the output buffer."""
+SENDFILE_MIN_BYTES = COPY_CHUNK_SIZE
+
+"""The size of the buffer that collects writes to the output dump file."""
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+"""The default limit on the number of bytes of svnlook output kept for reuse."""
+SVNLOOK_CACHE_BYTES = 512 * 1024 * 1024
+
+"""The number of svnlook commands run concurrently when untangling a directory."""
+SVNLOOK_WORKERS = os.cpu_count() or 1
+
+"""The number of log messages held before they are written out together."""
+LOG_BUFFER_RECORDS = 1024
+
+"""The number of matched paths above which paths are looked up in the trie of matches instead of compared with each match."""
+MATCH_TRIE_THRESHOLD = 16
+
+"""The number of path lookups remembered by a matcher before they are forgotten."""
+MATCH_CACHE_ENTRIES = 1 << 16
+
+"""The number of bytes read from the input or written to the output between hints to drop them from the page cache."""
+PAGE_CACHE_RELEASE_BYTES = 128 * 1024 * 1024
+
+"""The input dump file name that reads the dump from standard input."""
+STDIN_NAME = '-'
+
+"""Marks original revisions in the revision map that have not been seen yet."""
+REV_MAP_UNSET = (1 << 64) - 1
+
 VALID_DUMP_FORMAT_VERSIONS = [2, 3]
 DUMP_FORMAT_VERSION = 'SVN-fs-dump-format-version'
 DUMP_UUID = 'UUID'
@@ -96,80 +136,338 @@ NODE_COPYFROM_REV = 'Node-copyfrom-rev'
 PROP_END = b'PROPS-END'  # Use binary for matching against encoded lines
 SVN_MERGEINFO = 'svn:mergeinfo\n'
 
+"""The headers tying a node record to its copy source, stripped when the copy is replaced by its full text, by dump version."""
+COPY_SOURCE_HEADERS = {2: (NODE_COPYFROM_REV, NODE_COPYFROM_PATH, TEXT_COPY_SOURCE_MD5, TEXT_COPY_SOURCE_SHA1)}
+COPY_SOURCE_HEADERS[3] = COPY_SOURCE_HEADERS[2] + (TEXT_DELTA, TEXT_DELTA_BASE_MD5, TEXT_DELTA_BASE_SHA1)
+
+"""Matches the dump header lines holding the dump version and the repository UUID."""
+_VERSION_RE = re.compile(re.escape(DUMP_FORMAT_VERSION.encode()) + rb': (\d+)')
+_UUID_RE = re.compile(re.escape(DUMP_UUID.encode()) + rb': ([\w-]+)')
+
+"""Matches the blank and '* Dumped revision' lines between records, and the lines of a record header."""
+_SEPARATOR_RE = re.compile(rb'(?:\n|\* Dumped revision [^\n]*\n)*')
+_HEADER_LINE_RE = re.compile(rb'^([^:\n]+): (.*)$', re.MULTILINE)
+
+"""Matches the key/value (and, for version 3, delete) lines of a property section by dump version."""
+_PROP_RE = {2: re.compile(rb'^[KV] \d+$'), 3: re.compile(rb'^[KVD] \d+$')}
+
+"""
+Maps each header key read from the dump file to its decoded string. Seeded with the known keys so
+that keys read from the dump file are the same objects as the constants above.
+"""
+_KEY_CACHE = {key.encode(): sys.intern(key) for key in (
+    REV_NUM, CONTENT_LEN, PROP_CONTENT_LEN, TEXT_CONTENT_LEN, TEXT_COPY_SOURCE_MD5, TEXT_COPY_SOURCE_SHA1,
+    TEXT_DELTA, TEXT_DELTA_BASE_MD5, TEXT_DELTA_BASE_SHA1, NODE_PATH, NODE_KIND, NODE_ACTION,
+    NODE_COPYFROM_PATH, NODE_COPYFROM_REV)}
+
+"""Maps the header values that come from a small vocabulary to a single shared string each."""
+_VALUE_CACHE = {value.encode(): sys.intern(value) for value in (
+    'add', 'delete', 'change', 'replace', 'file', 'dir', 'true', 'false')}
+
+logger = logging.getLogger('svndumpfilter')
+
 
 class svndump_file():
     """ Class to handle reading of input from an svndump file.
 
-        Provides the ability to text lines and binary content
+        The dump file is memory mapped and read with offset arithmetic over
+        the mapping. Provides the ability to text lines and binary content
         lines.
     """
 
+    zero_copy = True  # Unmodified records are written straight from the mapping
+    random_access = True  # Bodies can be read again from their offset when written
+
+    def __init__(self, dumpfilename):
+        self.file_object = open(dumpfilename, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file_object.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file_object.close()
+            raise
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+        self.pos = 0
+        self.size = len(self.mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Release the mapping and the underlying file. """
+        self.mm.close()
+        self.file_object.close()
+
+    def readline_bytes(self):
+        """ Semantics of readline() to read and return a raw line, including its new line, from the file. """
+        if self.pos >= self.size:
+            return b''
+        nl = self.mm.find(b'\n', self.pos)
+        if nl < 0:
+            text_line = self.mm[self.pos:self.size] + b'\n'
+            self.pos = self.size
+        else:
+            text_line = self.mm[self.pos:nl + 1]
+            self.pos = nl + 1
+        return text_line
+
+    def readline(self):
+        """ Semantics of readline() to read and return a textual line from the file. """
+        return self.readline_bytes().decode('utf-8')
+
+    def read(self, bytes_to_read):
+        """ Semantics of read() to read and return the passed number of bytes from the file. """
+        byte_line = self.mm[self.pos:self.pos + bytes_to_read]
+        self.pos += len(byte_line)
+        if len(byte_line) != bytes_to_read:
+            raise TruncatedDumpError('Expected {0} bytes but the dump file ends at offset {1}'.format(bytes_to_read, self.pos))
+        return byte_line
+
+    def tell(self):
+        """ Semantics of tell() which is the current offset into the mapping.  """
+        return self.pos
+
+    def seek(self, pos):
+        """ Semantics of seek() which only moves the current offset into the mapping. """
+        self.pos = pos
+
+    def skip_separators(self):
+        """
+        Moves past the blank and '* Dumped revision' lines before the next record in a single scan.
+        Returns False when the end of the file has been reached.
+        """
+        self.pos = _SEPARATOR_RE.match(self.mm, self.pos).end()
+        return self.pos < self.size
+
+    def scan_record(self):
+        """
+        Reads the header of the next record without moving the current position or building a Record.
+        Returns a dictionary of the header keys to their raw values and the offset just past the
+        record, or None at the end of the file.
+        """
+        start = _SEPARATOR_RE.match(self.mm, self.pos).end()
+        if start >= self.size:
+            return None
+        end = self.mm.find(b'\n\n', start)
+        if end < 0:
+            end = self.size
+        head = {decode_header_key(key): value for key, value in _HEADER_LINE_RE.findall(self.mm, start, end)}
+        return head, record_end(head, end + 2)
+
+    def copy_to(self, out_file, offset, length):
+        """
+        Copies length bytes starting at offset to out_file without changing the current position.
+        Where the platform allows it, bodies of at least SENDFILE_MIN_BYTES are moved in the kernel
+        with sendfile(). Smaller bodies go through the output buffer, as sendfile() needs it flushed first.
+        Returns the number of bytes copied, which is less than length when the file ends first.
+        """
+        copied = 0
+        if length >= SENDFILE_MIN_BYTES and hasattr(os, 'sendfile'):
+            out_file.flush()
+            try:
+                while length > 0:
+                    sent = os.sendfile(out_file.fileno(), self.file_object.fileno(), offset, length)
+                    if sent == 0:
+                        return copied  # The end of the file
+                    offset += sent
+                    length -= sent
+                    copied += sent
+            except OSError:
+                pass  # Copy whatever was not sent
+        return copied + self.write_range(out_file, offset, length)
+
+    def release(self, start, end):
+        """ Tells the kernel that the bytes between start and end will not be read again. """
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start and hasattr(mmap, 'MADV_DONTNEED'):
+            self.mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+        advise(self.file_object, start, end - start, 'POSIX_FADV_DONTNEED')
+
+    def write_range(self, out_file, offset, length):
+        """ Writes length bytes starting at offset to out_file from the mapping and returns the number written. """
+        with memoryview(self.mm) as view:
+            return out_file.write(view[offset:offset + length])
+
+
+class svndump_stream_file(svndump_file):
+    """ Class to handle reading of input from an svndump file that cannot be memory mapped.
+
+        Reads the file through an internally held buffer and keeps track of the offset
+        itself, so pipes such as standard input can be read. Bytes looked at ahead of
+        the current position are put back into the buffer instead of seeking back.
+        Provides the ability to text lines and binary content lines.
+    """
+
+    zero_copy = False  # Re-reading records through the file costs more than serializing them
+
     def _read_new_buffer(self):
         """ Read a new chunk of the file into the buffer. """
-        # self.read_buffer = bytearray(self.buf_size)
         self.read_buffer = self.file_object.read(self.buf_size)
-        self.read_buffer_size = len(self.read_buffer)
 
     def __init__(self, dumpfilename, buf_size=4096):
-        self.file_object = open(dumpfilename, 'rb')
+        if dumpfilename == STDIN_NAME:
+            self.file_object = open(sys.stdin.fileno(), 'rb', closefd=False)
+        else:
+            self.file_object = open(dumpfilename, 'rb')
         self.buf_size = buf_size
+        self.random_access = self.file_object.seekable()
+        self.size = os.fstat(self.file_object.fileno()).st_size if self.random_access else None
+        self.pos = 0  # Offset of the start of the read buffer
         self._read_new_buffer()
 
-    def readline(self):
-        """ Semantics of readline() to read and return a textual line from the file. """
-        if self.read_buffer == b'':
+    def close(self):
+        """ Release the underlying file. """
+        self.file_object.close()
+
+    def _unread(self, data):
+        """ Puts bytes that were read back in front of the read buffer. """
+        self.read_buffer = data + self.read_buffer
+        self.pos -= len(data)
+
+    def _readline_raw(self):
+        """ Reads a line including its new line, or without one at the end of the file. """
+        if not self.read_buffer:
             # Ensure the file is exhausted, not just at the end of the read buffer
             self._read_new_buffer()
-            if len(self.read_buffer) == 0:
-                return ''
-        try:
-            text_line, new_buffer = self.read_buffer.split(b'\n', maxsplit=1)
-        except ValueError:
-            # This can occur when at the end of the read buffer which has no new line. Need to
-            # concat current contents to a new read buffer split at a new line
-            first_part = self.read_buffer
-            self._read_new_buffer()
-            second_part, new_buffer = self.read_buffer.split(b'\n', maxsplit=1)
-            text_line = first_part + second_part
-        if new_buffer == []:
+            if not self.read_buffer:
+                return b''
+        line_parts = []
+        nl = self.read_buffer.find(b'\n')
+        while nl < 0:
+            # The line continues past the end of the read buffer
+            line_parts.append(self.read_buffer)
+            self.pos += len(self.read_buffer)
             self._read_new_buffer()
-        else:
-            self.read_buffer = new_buffer
-        return text_line.decode('utf-8') + '\n'
+            if not self.read_buffer:
+                return b''.join(line_parts)
+            nl = self.read_buffer.find(b'\n')
+        line_parts.append(self.read_buffer[:nl + 1])
+        self.read_buffer = self.read_buffer[nl + 1:]
+        self.pos += nl + 1
+        return b''.join(line_parts)
+
+    def readline_bytes(self):
+        """ Semantics of readline() to read and return a raw line, including its new line, from the file. """
+        line = self._readline_raw()
+        if line and not line.endswith(b'\n'):
+            line += b'\n'
+        return line
 
     def read(self, bytes_to_read):
         """ Semantics of read() to read and return the passed number of bytes from the file. """
-        byte_line = bytearray(bytes_to_read + 1)
-        incomplete = True
+        byte_line = bytearray()
         bytes_left_to_read = bytes_to_read
-        while incomplete:
-            read_buffer_size = len(self.read_buffer)
-            slice_start = bytes_to_read - bytes_left_to_read
-            if read_buffer_size > bytes_left_to_read:
-                byte_line[slice_start:] = self.read_buffer[0:bytes_left_to_read]
-                self.read_buffer = self.read_buffer[bytes_left_to_read:]
-                incomplete = False
-            elif read_buffer_size == bytes_left_to_read:
-                byte_line[slice_start:] = self.read_buffer
-                self._read_new_buffer()
-                incomplete = False
-            else:
-                slice_start = bytes_to_read - bytes_left_to_read
-                byte_line[slice_start: slice_start + read_buffer_size] = self.read_buffer[0:]
-                bytes_left_to_read -= read_buffer_size
+        while bytes_left_to_read:
+            if not self.read_buffer:
                 self._read_new_buffer()
-
-        return byte_line
+                if not self.read_buffer:
+                    break
+            taken = self.read_buffer[:bytes_left_to_read]
+            byte_line += taken
+            self.read_buffer = self.read_buffer[len(taken):]
+            self.pos += len(taken)
+            bytes_left_to_read -= len(taken)
+        if bytes_left_to_read:
+            raise TruncatedDumpError('Expected {0} bytes but the dump file ends at offset {1}'.format(bytes_to_read, self.pos))
+        return bytes(byte_line)
 
     def tell(self):
-        """ Semantics of tell() which is actually the current point in buffer.  """
-        fp_tell = self.file_object.tell()
-        return fp_tell - len(self.read_buffer)
+        """ Semantics of tell() which is the offset of the next byte to be read.  """
+        return self.pos
 
     def seek(self, pos):
-        """ Semantics of seek() which requires updating the internally held read buffer. """
-        self.file_object.seek(pos)
-        self._read_new_buffer()
+        """
+        Semantics of seek() which requires updating the internally held read buffer.
+        A file that cannot seek, such as a pipe, can only be moved forward.
+        """
+        if pos >= self.pos and (pos - self.pos <= len(self.read_buffer) or not self.random_access):
+            # Skip forward by reading, the bytes are either buffered or cannot be seeked past
+            skip = pos - self.pos
+            while skip > len(self.read_buffer):
+                skip -= len(self.read_buffer)
+                self.pos += len(self.read_buffer)
+                self.read_buffer = self.file_object.read(max(self.buf_size, min(skip, COPY_CHUNK_SIZE)))
+                if not self.read_buffer:
+                    return
+            self.read_buffer = self.read_buffer[skip:]
+            self.pos = pos
+        elif self.random_access:
+            self.file_object.seek(pos)
+            self.pos = pos
+            self._read_new_buffer()
+        else:
+            raise OSError('Cannot seek back to offset {0} of a dump file read from a pipe'.format(pos))
+
+    def release(self, start, end):
+        """ Tells the kernel that the bytes between start and end will not be read again. """
+        advise(self.file_object, start, end - start, 'POSIX_FADV_DONTNEED')
+
+    def skip_separators(self):
+        """
+        Moves past the blank and '* Dumped revision' lines before the next record.
+        Returns False when the end of the file has been reached.
+        """
+        line = self._readline_raw()
+        while line == b'\n' or line.startswith(b'* Dumped revision '):
+            line = self._readline_raw()
+        self._unread(line)
+        return line != b''
+
+    def scan_record(self):
+        """
+        Reads the header of the next record without moving the current position or building a Record.
+        Returns a dictionary of the header keys to their raw values and the offset just past the
+        record, or None at the end of the file.
+        """
+        self.skip_separators()
+        consumed = []
+        head = {}
+        line = self._readline_raw()
+        while line not in (b'\n', b''):
+            consumed.append(line)
+            key, value = line.split(b': ', 1)
+            head[decode_header_key(key)] = value.rstrip(b'\n')
+            line = self._readline_raw()
+        consumed.append(line)
+        end = self.pos
+        self._unread(b''.join(consumed))
+        if not head:
+            return None
+        return head, record_end(head, end)
+
+    def write_range(self, out_file, offset, length):
+        """
+        Writes length bytes starting at offset to out_file in chunks, leaving the read buffer untouched.
+        Only files with random access can be read again like this. Returns the number of bytes written.
+        """
+        resume = self.file_object.tell()
+        self.file_object.seek(offset)
+        copied = 0
+        while copied < length:
+            chunk = self.file_object.read(min(length - copied, COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            out_file.write(chunk)
+            copied += len(chunk)
+        self.file_object.seek(resume)
+        return copied
+
+
+def open_svndump_file(dumpfilename):
+    """
+    Opens the svndump file for reading, memory mapped when possible.
+    """
+    if dumpfilename == STDIN_NAME:
+        return svndump_stream_file(dumpfilename)
+    try:
+        return svndump_file(dumpfilename)
+    except (OSError, ValueError):
+        # Empty files and files that are not regular files cannot be mapped
+        return svndump_stream_file(dumpfilename)
 
 
 def encode_to_fs(name):
@@ -186,6 +484,70 @@ def decode_from_fs(filename):
     return filename.decode(sys.getfilesystemencoding()).encode('utf-8')
 
 
+def decode_header_key(key):
+    """
+    Converts a header key read from the dump file to a string. Keys come from a small set so
+    each is decoded once and the same interned string is reused for every record.
+    """
+    try:
+        return _KEY_CACHE[key]
+    except KeyError:
+        _KEY_CACHE[key] = sys.intern(key.decode('utf-8'))
+        return _KEY_CACHE[key]
+
+
+def iter_lines(data):
+    """
+    Yields the lines of a bytes object without their newlines, without building a list of them.
+    A trailing newline does not produce an empty last line.
+    """
+    start = 0
+    end = len(data)
+    while start < end:
+        newline = data.find(b'\n', start)
+        if newline < 0:
+            yield data[start:]
+            return
+        yield data[start:newline]
+        start = newline + 1
+
+
+def record_end(head, offset):
+    """
+    Returns the offset just past the properties and body of a record whose header, given as
+    raw values, ends at offset.
+    """
+    return offset + int(head.get(PROP_CONTENT_LEN, 0)) + int(head.get(TEXT_CONTENT_LEN, 0))
+
+
+def advise(d_file, offset, length, advice):
+    """
+    Passes an access pattern hint for the file to the kernel where supported.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(d_file.fileno(), offset, length, getattr(os, advice))
+        except OSError:
+            pass  # Pipes and devices do not accept hints
+
+
+def release_page_cache(input_file, output_file, released):
+    """
+    Once PAGE_CACHE_RELEASE_BYTES have been read or written since the last call that released them,
+    tells the kernel that the input read and the output written so far will not be needed again.
+    This keeps a large dump file from pushing everything else out of the page cache.
+    """
+    position = input_file.tell()
+    if position - released['input'] >= PAGE_CACHE_RELEASE_BYTES:
+        input_file.release(released['input'], position)
+        released['input'] = position
+    position = output_file.tell()
+    if position - released['output'] >= PAGE_CACHE_RELEASE_BYTES:
+        output_file.flush()
+        advise(output_file, released['output'], position - released['output'], 'POSIX_FADV_DONTNEED')
+        released['output'] = position
+
+
 def write_empty_lines(d_file, number=1):
     """
     Writes a variable number of empty lines.
@@ -216,24 +578,24 @@ class DumpHeader(object):
         """
         Extracts the dump version and repository UUID from the dump file.
         """
-        self.version = self._find_version(d_file.readline())
-        d_file.readline()
-        self.UUID = self._find_UUID(d_file.readline())
-        d_file.readline()
+        self.version = self._find_version(d_file.readline_bytes())
+        d_file.readline_bytes()
+        self.UUID = self._find_UUID(d_file.readline_bytes())
+        d_file.readline_bytes()
 
     def _find_version(self, line):
         """
         Provides regular expression matching to extract the dump version.
         """
-        res = re.match(r'{}: (\d+)'.format(DUMP_FORMAT_VERSION), line)
+        res = _VERSION_RE.match(line)
         return int(res.group(1))
 
     def _find_UUID(self, line):
         """
         Provides regular expression matching to extract the UUID of the repository.
         """
-        res = re.match(r'{}: ([\w-]+)'.format(DUMP_UUID), line)
-        return res.group(1)
+        res = _UUID_RE.match(line)
+        return res.group(1).decode()
 
 
 class Record(object):
@@ -242,20 +604,37 @@ class Record(object):
     Encapsulates the logic for node records and revision records.
     """
 
+    __slots__ = ('type', 'head', 'order_head', '_head_index', 'order_prop', 'body', 'body_ref', 'raw_ref', 'dump_format')
+
     def __init__(self, dump_format=2):
         self.head = {}
         self.order_head = []  # This is dictionary of tuples to act as an OrderedDict
+        self._head_index = {}  # Position of each key in order_head
         self.order_prop = []
         self.body = None
+        self.body_ref = None  # (svndump file, offset, length) of a body left in the input dump file
+        self.raw_ref = None  # (svndump file, offset, length) of the header and properties while unmodified
         self.dump_format = dump_format
 
+    def _has_body(self):
+        """
+        Whether the record has a non-empty body, either held in memory or referenced in the input dump file.
+        """
+        if self.body_ref is not None:
+            return self.body_ref[2] > 0
+        return bool(self.body)
+
     def _add_header(self, key, value):
         """
         Adds a header to the dictionary for querying and the ordered dictionary for writing.
+        The value may be passed as raw bytes from the dump file.
         """
         if value.isdigit():
             value = int(value)
+        elif isinstance(value, bytes):
+            value = _VALUE_CACHE.get(value) or value.decode('utf-8')
         self.head[key] = value
+        self._head_index.setdefault(key, len(self.order_head))
         self.order_head.append((key, value))
 
     def _add_property(self, key, value):
@@ -264,60 +643,82 @@ class Record(object):
         """
         self.order_prop.append((key, value))
 
-    def _write_end_prop(self, d_file):
+    def _write_end_prop(self, buf):
         """
-        Writes out the PROPS-END tag with proper spacing.
+        Appends the PROPS-END tag with proper spacing to the buffer.
         Accounts for the different spacings created by a standard svn dump.
         """
         if PROP_CONTENT_LEN in self.head:
             if self.type == 'Node' and self.head[NODE_ACTION] == 'delete':
-                write_empty_lines(d_file)
+                buf += b'\n'
             else:
-                d_file.write(PROP_END)
-                write_empty_lines(d_file)
+                buf += PROP_END
+                buf += b'\n'
                 if self.type == 'Node':
-                    if not self.body:
-                        write_empty_lines(d_file)
+                    if not self._has_body():
+                        buf += b'\n'
                         if not self.order_prop:
-                            write_empty_lines(d_file)
+                            buf += b'\n'
                 else:
-                    write_empty_lines(d_file)
+                    buf += b'\n'
         else:
-            if not self.body:
-                write_empty_lines(d_file)
+            if not self._has_body():
+                buf += b'\n'
 
-    def _write_header(self, d_file):
+    def _write_header(self, buf):
         """
-        Writes out the RFC822-style headers.
+        Appends the RFC822-style headers to the buffer.
         """
         for kv in self.order_head:
-            d_file.write('{}: {}\n'.format(kv[0], kv[1]).encode())
-        write_empty_lines(d_file)
+            buf += '{}: {}\n'.format(kv[0], kv[1]).encode()
+        buf += b'\n'
 
-    def _write_properties(self, d_file):
+    def _write_properties(self, buf):
         """
-        Writes out the property section of the record.
+        Appends the property section of the record to the buffer.
         """
         for kv in self.order_prop:
-            d_file.write('{}'.format(kv[0]).encode())
-            d_file.write('{}'.format(kv[1]).encode())
+            buf += '{}{}'.format(kv[0], kv[1]).encode()
 
     def _write_body(self, d_file):
         """
         Writes out the body of the record.
         """
-        d_file.write(self.body)
-        assert int(self.head[TEXT_CONTENT_LEN]) == len(self.body)
+        if self.body_ref is not None:
+            input_file, offset, length = self.body_ref
+            copied = input_file.copy_to(d_file, offset, length)
+            if copied < length:
+                raise TruncatedDumpError('{0}: {1} but the dump file ends at offset {2}'.format(TEXT_CONTENT_LEN, length, offset + copied))
+        else:
+            d_file.write(self.body)
+            assert int(self.head[TEXT_CONTENT_LEN]) == len(self.body)
         write_empty_lines(d_file, 2)
 
+    def serialize(self):
+        """
+        Returns the headers and property section of the record, with their trailing spacing, as bytes.
+        """
+        buf = bytearray()
+        self._write_header(buf)
+        self._write_properties(buf)
+        self._write_end_prop(buf)
+        return buf
+
     def write_segment(self, d_file):
         """
         Writes out the entire record as a segment.
+        A record left unmodified since it was read has its header and properties written straight from
+        the input dump file, without serializing them again.
         """
-        self._write_header(d_file)
-        self._write_properties(d_file)
-        self._write_end_prop(d_file)
-        if self.body:
+        if self.raw_ref is not None:
+            input_file, offset, length = self.raw_ref
+            input_file.write_range(d_file, offset, length)
+            buf = bytearray()
+            self._write_end_prop(buf)
+            d_file.write(buf)
+        else:
+            d_file.write(self.serialize())
+        if self._has_body():
             self._write_body(d_file)
 
     def _swallow_empty_lines(self, d_file):
@@ -325,13 +726,7 @@ class Record(object):
         Removes whitespace lines until reaching a line without whitespace. Remains at the line
         without whitespace when finishing.
        """
-        pos = d_file.tell()
-        line = d_file.readline()
-        while line == '\n' or line.startswith('* Dumped revision '):
-            pos = d_file.tell()
-            line = d_file.readline()
-        d_file.seek(pos)
-        return line != ''
+        return d_file.skip_separators()
 
     def _extract_header(self, d_file):
         """
@@ -340,14 +735,15 @@ class Record(object):
         if not self._swallow_empty_lines(d_file):
             raise FinishedFiltering('There are no more records to process.')
 
-        line = d_file.readline()
-        while line != '\n':
-            key, value = line.split(': ', 1)
-            clean_val = value.rstrip('\n')
-            if key == 'Revision-number':
-                print('...{}'.format(value))
-            self._add_header(key, clean_val)
-            line = d_file.readline()
+        start = d_file.tell()
+        line = d_file.readline_bytes()
+        while line != b'\n':
+            key, value = line.split(b': ', 1)
+            clean_val = value.rstrip(b'\n')
+            self._add_header(decode_header_key(key), clean_val)
+            line = d_file.readline_bytes()
+        if d_file.zero_copy:
+            self.raw_ref = (d_file, start, d_file.tell() - start)
 
         if REV_NUM in self.head:
             self.type = 'Revision'
@@ -361,68 +757,99 @@ class Record(object):
         if PROP_CONTENT_LEN in self.head:
             prop_bytes = self.head[PROP_CONTENT_LEN]
             prop = d_file.read(int(prop_bytes))
-            prop_list = prop.splitlines()
-            try:
-                if prop_list[-1] == '':
-                    prop_list = prop_list[:-1]
-            except ValueError:
-                pass
-            if PROP_END in prop_list:
-                prop_list.remove(PROP_END)
             symbol = None
-            content = ''
-            if self.dump_format == 2:
-                prog = re.compile(r'^[KV] [\d]+$')
-            else:  # Version format 3
-                prog = re.compile(r'^[KVD] [\d]+$')
-            for line in prop_list:
-                decoded_line = line.decode('utf-8')
+            content_parts = []
+            prog = _PROP_RE[self.dump_format]
+            for line in iter_lines(prop):
+                if line == PROP_END:
+                    continue
                 if not symbol:
-                    symbol = decoded_line + '\n'
+                    symbol = line.decode('utf-8') + '\n'
                 else:
-                    if prog.match(decoded_line):
-                        self._add_property(symbol, content)
-                        content = ''
-                        symbol = decoded_line + '\n'
+                    if prog.match(line):
+                        self._add_property(symbol, b''.join(content_parts).decode('utf-8'))
+                        content_parts = []
+                        symbol = line.decode('utf-8') + '\n'
                     else:
-                        content = content + decoded_line + '\n'
+                        content_parts.append(line)
+                        content_parts.append(b'\n')
             if symbol:  # The last "Value" and its content should be added.
-                self._add_property(symbol, content)
+                self._add_property(symbol, b''.join(content_parts).decode('utf-8'))
+            if self.raw_ref is not None:
+                # The trailing PROPS-END is left to _write_end_prop(), like when serializing
+                if prop.endswith(PROP_END + b'\n') and not (self.type == 'Node' and self.head.get(NODE_ACTION) == 'delete'):
+                    start = self.raw_ref[1]
+                    self.raw_ref = (d_file, start, d_file.tell() - len(PROP_END) - 1 - start)
+                else:
+                    self.raw_ref = None
 
     def _extract_body(self, d_file):
         """
          Extract the body of a record from a dump file.
         """
         if TEXT_CONTENT_LEN in self.head:
-            self.body = d_file.read(int(self.head[TEXT_CONTENT_LEN]))
+            length = int(self.head[TEXT_CONTENT_LEN])
+            if d_file.random_access:
+                # The body is only referenced here and copied straight to the output when written
+                start = d_file.tell()
+                if start + length > d_file.size:
+                    raise TruncatedDumpError('{0}: {1} but the dump file ends at offset {2}'.format(TEXT_CONTENT_LEN, length, d_file.size))
+                self.body_ref = (d_file, start, length)
+                d_file.seek(start + length)
+            else:
+                self.body = d_file.read(length)  # A pipe cannot be read again, so the body is held
 
-    def extract_segment(self, d_file):
+    def extract_header(self, d_file):
         """
-        Extracts an entire record from a dump file.
+        Extracts the header of a record from a dump file, leaving the dump file at its properties.
         """
         self._extract_header(d_file)
+
+    def extract_rest(self, d_file):
+        """
+        Extracts the properties and body of a record whose header has been extracted.
+        """
         self._extract_properties(d_file)
         self._extract_body(d_file)
 
+    def extract_segment(self, d_file):
+        """
+        Extracts an entire record from a dump file.
+        """
+        self.extract_header(d_file)
+        self.extract_rest(d_file)
+
     def update_head(self, key, value):
         """
         Adds a new header line with the key and value arguments.
         Remove a pre-existing header if it shares the same key.
         """
+        self.raw_ref = None
         self.head[key] = value
-        insert = True
-        for i, prop in enumerate(self.order_head):
-            if prop[0] == key:
-                self.order_head[i] = (prop[0], value)
-                insert = False
-                break
-        if insert:
+        i = self._head_index.get(key)
+        if i is None or i >= len(self.order_head) or self.order_head[i][0] != key:
+            # order_head was assigned or edited directly, so the index is stale
+            self._rebuild_head_index()
+            i = self._head_index.get(key)
+        if i is not None:
+            self.order_head[i] = (key, value)
+        else:
             self.order_head.insert(0, (key, value))
+            self._rebuild_head_index()
+
+    def _rebuild_head_index(self):
+        """
+        Recomputes the position of the first occurrence of each header key in order_head.
+        """
+        self._head_index = {}
+        for i, kv in enumerate(self.order_head):
+            self._head_index.setdefault(kv[0], i)
 
     def update_new_props(self, new_props):
         """
         Update to a new list of properties
         """
+        self.raw_ref = None
         self.order_prop.clear()
         for kv in new_props:
             self.order_prop.append(kv)
@@ -441,10 +868,17 @@ class MatchFiles(object):
     Determines which files are included in the final output repository.
     """
 
+    __slots__ = ('include', '_polarity', 'debug', 'matches', '_tries', '_rules', '_match', '_cache')
+
     def __init__(self, include, debug=False):
         self.include = include  # Whether these are matches to include or matches to exclude
+        self._polarity = not include  # Turns whether a path matched into whether it is included
         self.debug = debug
         self.matches = {}
+        self._tries = None  # Maps the type of a path to the trie walked when there are many matches, built on first use
+        self._rules = None  # Maps the type of a path to the matches compared when there are few matches, built on first use
+        self._match = None  # Maps the type of a path to the function matching it
+        self._cache = {}  # Results of is_included by path
 
     def __repr__(self):
         match_output = pprint.pformat(self.matches)
@@ -455,21 +889,25 @@ class MatchFiles(object):
 
     def _extract_path(self, path):
         """
-        Split the path into a list of elements
+        Split the path into a list of elements. The elements are interned as they are shared by many paths.
         """
-        return path.split('/')
+        return [sys.intern(comp) for comp in path.split('/')]
 
     def add_to_matches(self, path):
         """
         Adds each component of the path to a dictionary where each level of the dictionary represents how far
-        into the path you are. The last level for each path added always ends with a {1:1} delimiter.
+        into the path you are. The last level for each path added always ends with a {None: True} delimiter.
 
         Example:
         If you have paths for dir1/dir2/dir3, dir1, and dir4/, the structure of the dictionary
         will look like:
 
-        { dir1 : { dir 2: { dir 3: { 1:1 } }, { 1:1 } }, dir 4 : { 1:1 } }
+        { dir1 : { dir 2: { dir 3: { None: True } }, None: True }, dir 4 : { None: True } }
         """
+        self._tries = None
+        self._rules = None
+        self._match = None
+        self._cache.clear()
         if path[-1] == '/':  # Takes care of the case when you have dir1/dir2/dir3/ as input
             path = path[:-1]
         path_comps = self._extract_path(path)
@@ -482,9 +920,9 @@ class MatchFiles(object):
                     # Add the remaining elements because there are no more overlapping components
                     curr[elem] = {}
                     curr = curr[elem]
-                curr[1] = 1
+                curr[None] = True
                 return
-        curr[1] = 1
+        curr[None] = True
 
     def read_matches_from_file(self, filename):
         """
@@ -497,29 +935,87 @@ class MatchFiles(object):
                 else:
                     self.add_to_matches(line.rstrip('\n'))
 
+    def _flatten_trie(self):
+        """
+        Yields each full path added to the matches, i.e. each path ending with a {None: True} delimiter.
+        Paths below another added path are left out, they can never change whether a path matches.
+        """
+        to_process = [('', self.matches)]
+        for prefix, curr in to_process:
+            for comp, sub in curr.items():
+                if None in sub:
+                    yield prefix + comp
+                else:
+                    to_process.append((prefix + comp + '/', sub))
+
+    def _encode_trie(self, curr):
+        """
+        Returns a copy of the trie with each component encoded the way it is in the dump file.
+        """
+        return {comp if comp is None else comp.encode('utf-8', 'surrogateescape'): sub if comp is None else self._encode_trie(sub)
+                for comp, sub in curr.items()}
+
+    def compile(self):
+        """
+        Chooses how a path is matched against the matches, including anything below them: comparing
+        it with each match, or walking the trie of the matches. Up to MATCH_TRIE_THRESHOLD paths,
+        the startswith() comparisons run in C and beat looking up each component of the path.
+        Paths may be checked as str or as the raw bytes read from the dump file.
+        """
+        paths = list(self._flatten_trie())
+        if len(paths) > MATCH_TRIE_THRESHOLD:
+            self._tries = {str: ('/', self.matches), bytes: (b'/', self._encode_trie(self.matches))}
+            self._match = {str: self._match_trie, bytes: self._match_trie}
+        else:
+            raw_paths = [path.encode('utf-8', 'surrogateescape') for path in paths]
+            self._rules = {str: (frozenset(paths), tuple(path + '/' for path in paths)),
+                           bytes: (frozenset(raw_paths), tuple(path + b'/' for path in raw_paths))}
+            self._match = {str: self._match_rules, bytes: self._match_rules}
+
+    def _match_rules(self, path):
+        """
+        Whether the path is one of the matches or starts with one of them followed by a '/'.
+        """
+        paths, prefixes = self._rules[type(path)]
+        return path in paths or path.startswith(prefixes)
+
+    def _match_trie(self, path):
+        """
+        Whether the path, or one of the directories above it, ends a path in the trie of matches.
+        """
+        separator, curr = self._tries[type(path)]
+        for comp in path.split(separator):
+            curr = curr.get(comp)
+            if curr is None:
+                return False
+            if None in curr:
+                return True
+        return False
+
     def is_included(self, path):
         """
         Checks to see if a path should be included in the output dump file.
         """
-        result = False
-        path_comps = self._extract_path(path)
-        curr = self.matches
-        for comp in path_comps:
-            if comp not in curr or 1 in curr:
-                break
-            curr = curr[comp]
-        if 1 in curr:
-            result = True
+        if not self.matches:
+            result = self._polarity  # Nothing can match, so there is nothing to look up
+        else:
+            result = self._cache.get(path)
+            if result is None:
+                if self._match is None:
+                    self.compile()
+                result = bool(self._match[type(path)](path)) ^ self._polarity
+                if len(self._cache) >= MATCH_CACHE_ENTRIES:
+                    self._cache.clear()
+                self._cache[path] = result
         if self.debug:
             if self.include:
                 verb = 'including'
             else:
                 verb = 'excluding'
-            print('Checking path {0} - {1} result'.format(path, verb).encode('utf-8'))
-        if self.include:
-            return result
-        else:
-            return not result
+            if isinstance(path, bytes):
+                path = path.decode('utf-8', 'replace')
+            logger.debug('Checking path %s - %s result', path, verb)
+        return result
 
 
 def write_segments(d_file, segments):
@@ -541,10 +1037,85 @@ class SVNLookError(Exception):
     pass
 
 
+class UnknownRevisionError(Exception):
+
+    """
+    Raised when a node record copies from a revision that has not been read from the dump file,
+    so there is no renumbered revision to copy from.
+    """
+    pass
+
+
+class TruncatedDumpError(Exception):
+
+    """
+    Raised when the dump file ends before all the bytes its headers say follow have been read.
+    """
+    pass
+
+
+class SVNLookCache(object):
+
+    """
+    Least recently used cache of svnlook output, bounded by the total number of bytes cached.
+    Untangled revisions often copy from the same paths, so their svnlook runs repeat.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()  # svnlook runs from several threads when untangling directories
+
+    def get(self, key):
+        """
+        Returns the cached output for the key, or None when it is not cached.
+        """
+        with self.lock:
+            out = self.entries.get(key)
+            if out is not None:
+                self.entries.move_to_end(key)
+            return out
+
+    def put(self, key, out):
+        """
+        Caches the output, evicting the least recently used entries to stay within the byte budget.
+        """
+        with self.lock:
+            if len(out) > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = out
+            self.size += len(out)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+svnlook_cache = SVNLookCache(SVNLOOK_CACHE_BYTES)
+_svnlook_executor = None
+
+
+def get_svnlook_executor():
+    """
+    Returns the thread pool that runs independent svnlook commands concurrently, creating it on first use.
+    """
+    global _svnlook_executor
+    if _svnlook_executor is None:
+        _svnlook_executor = ThreadPoolExecutor(max_workers=SVNLOOK_WORKERS)
+    return _svnlook_executor
+
+
 def run_svnlook_command(command, rev_num, repo_path, file_path, filtering, debug):
     """
     Runs svnlook to grab the contents of a repository or the contents of a file.
+    Successful output is cached so repeated requests do not run svnlook again.
     """
+    cache_key = (command, str(rev_num), repo_path, file_path, filtering)
+    out = svnlook_cache.get(cache_key)
+    if out is not None:
+        if debug:
+            logger.debug('Using cached output for %s', cache_key)
+        return out
     file_path = encode_to_fs(file_path)
     command_list = ['svnlook']
     if filtering:  # svn tree
@@ -552,7 +1123,7 @@ def run_svnlook_command(command, rev_num, repo_path, file_path, filtering, debug
     else:  # svn cat
         command_list.extend(['-r', str(rev_num), command, repo_path, file_path.decode()])
     if debug:
-        print(command_list)
+        logger.debug('%s', command_list)
     with TemporaryFile() as stdout_temp_file, TemporaryFile() as stderr_temp_file:
         process = subprocess.Popen(command_list, shell=False, stdout=stdout_temp_file, stderr=stderr_temp_file)  # nosec B603
         exit_code = process.wait()
@@ -565,6 +1136,7 @@ def run_svnlook_command(command, rev_num, repo_path, file_path, filtering, debug
             stdout_temp_file.flush()
             stdout_temp_file.seek(0)
             out = stdout_temp_file.read()
+            svnlook_cache.put(cache_key, out)
             return out
 
 
@@ -593,16 +1165,34 @@ def handle_missing_directory(d_file, from_path, destination, rev_num, repo_path,
     output = run_svnlook_command('tree', rev_num, repo_path, from_path, '--full-paths', debug)
     output = output.splitlines()
     files = [a for a in output if a != ' ' and a != '']
+    executor = get_svnlook_executor()
+    pending = deque()  # (destination, future of the file contents or None for a directory) in output order
     for transfer_file in files:
         transfer_file = decode_from_fs(transfer_file).decode()
+        # Bound the number of file contents held in memory while svnlook runs ahead
+        while len(pending) >= 2 * SVNLOOK_WORKERS:
+            add_missing_to_dump(d_file, *pending.popleft(), dump_version)
         if transfer_file[-1] == '/':
-            add_dir_to_dump(d_file, destination + '/' + transfer_file[len(from_path) + 1:], dump_version)
+            pending.append((destination + '/' + transfer_file[len(from_path) + 1:], None))
         elif transfer_file == from_path + '/':
-            add_dir_to_dump(d_file, destination, dump_version)
+            pending.append((destination, None))
         else:
             file_from = from_path + '/' + transfer_file[len(from_path) + 1:]
             file_dest = destination + '/' + transfer_file[len(from_path) + 1:]
-            handle_missing_file(d_file, file_from, file_dest, rev_num, repo_path, dump_version, debug)
+            file_body = executor.submit(run_svnlook_command, 'cat', rev_num, repo_path, file_from, None, debug)
+            pending.append((file_dest, file_body))
+    while pending:
+        add_missing_to_dump(d_file, *pending.popleft(), dump_version)
+
+
+def add_missing_to_dump(d_file, destination, file_body, dump_version):
+    """
+    Adds a directory, or a file once svnlook has retrieved its contents, to the output dump file.
+    """
+    if file_body is None:
+        add_dir_to_dump(d_file, destination, dump_version)
+    else:
+        add_file_to_dump(d_file, destination, dump_version, file_body.result())
 
 
 def create_node_record(file_path, kind, dump_version, body=None):
@@ -639,32 +1229,21 @@ def add_file_to_dump(d_file, file_path, dump_version, body):
     node_rec.write_segment(d_file)
 
 
-class Node(object):
-
-    """
-    Represents what components of the path were traversed to have this set of matches.
-    """
-
-    def __init__(self, path, matches):
-        self.path = path
-        self.matches = matches
-
-
 def add_dependents(to_write, matches, dump_version):
     """
     Adds dependent directories that are required to start at a non-top-level path for path matching.
+
+    Walks the trie of matches once, level by level so parents are added before their children,
+    adding a directory for each component that does not itself end a matched path.
     """
-    to_process = [Node('', matches)]
-    dir_to_add = []
-    for node in to_process:
-        for item in node.matches:
-            if 1 not in node.matches[item]:
-                to_process.append(Node(node.path + item + '/', node.matches[item]))
-                dir_to_add.append(node.path + item + '/')
-    for dir_path in dir_to_add:
-        node_rec = create_node_record(dir_path[:-1], 'dir', dump_version)
-        to_write.append(node_rec)
-    return len(dir_to_add) > 0
+    to_process = [('', matches)]
+    for prefix, curr in to_process:
+        for comp, sub_matches in curr.items():
+            if comp is not None and None not in sub_matches:
+                dir_path = prefix + comp
+                to_write.append(create_node_record(dir_path, 'dir', dump_version))
+                to_process.append((dir_path + '/', sub_matches))
+    return len(to_process) > 1
 
 
 def handle_deleting_file(d_file, file_path, dump_version):
@@ -691,14 +1270,27 @@ def handle_deleting_directory(d_file, file_path, dump_version):
     node_rec.write_segment(d_file)
 
 
+def strip_headers(node_seg, keys, debug=False):
+    """
+    Removes the headers with the given keys from the record in a single pass over its ordered headers.
+    """
+    if debug:
+        for key in keys:
+            if key in node_seg.head:
+                logger.debug('Stripping: %s', node_seg.head[key])
+    node_seg.raw_ref = None
+    node_seg.order_head = [kv for kv in node_seg.order_head if kv[0] not in keys]
+    for key in keys:
+        node_seg.head.pop(key, None)
+
+
 def update_prop_len(node_seg):
     """
     Calculate length of node properties
     """
     length = len(PROP_END) + 1
-    for i in node_seg.order_prop:
-        for k in i:
-            length += len(k)
+    for key, value in node_seg.order_prop:
+        length += len(key.encode()) + len(value.encode())
 
     node_seg.update_head(PROP_CONTENT_LEN, length)
     if TEXT_CONTENT_LEN in node_seg.head:
@@ -707,6 +1299,29 @@ def update_prop_len(node_seg):
         node_seg.update_head(CONTENT_LEN, length)
 
 
+class BitSet(object):
+
+    """
+    Set of non-negative integers, such as revision numbers, stored as one bit each in a growing bytearray.
+    """
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, number):
+        """
+        Adds the number to the set.
+        """
+        index = number >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (number & 7)
+
+    def __contains__(self, number):
+        index = number >> 3
+        return index < len(self.bits) and bool(self.bits[index] >> (number & 7) & 1)
+
+
 class FinishedFiltering(Exception):
 
     """
@@ -735,6 +1350,7 @@ def create_matcher(include, matches, opt):
         matcher.add_to_matches(match)
     if opt.file:
         matcher.read_matches_from_file(opt.file)
+    matcher.compile()
     return matcher
 
 
@@ -760,9 +1376,27 @@ def print_scan_results(scan, safe):
     """
     if scan:
         if safe:
-            print('Safe: No untangling is necessary to carve these paths.')
+            logger.info('Safe: No untangling is necessary to carve these paths.')
         else:
-            print('Unsafe: Untangling is necessary to carve these paths.')
+            logger.info('Unsafe: Untangling is necessary to carve these paths.')
+
+
+def map_revision(rev_map, orig_rev, renum_rev):
+    """
+    Stores the renumbered revision of an original revision, growing the map as needed.
+    """
+    if len(rev_map) <= orig_rev:
+        rev_map.extend(array('Q', [REV_MAP_UNSET]) * (orig_rev + 1 - len(rev_map)))
+    rev_map[orig_rev] = renum_rev
+
+
+def lookup_revision(rev_map, orig_rev):
+    """
+    Returns the renumbered revision of an original revision that has been read.
+    """
+    if 0 <= orig_rev < len(rev_map) and rev_map[orig_rev] != REV_MAP_UNSET:
+        return rev_map[orig_rev]
+    raise UnknownRevisionError('{0}: {1} refers to a revision that has not been read'.format(NODE_COPYFROM_REV, orig_rev))
 
 
 def process_revision_record(rev_map, check, include, flags, opt, dump_version):
@@ -776,7 +1410,7 @@ def process_revision_record(rev_map, check, include, flags, opt, dump_version):
     if opt.start_revision and int(opt.start_revision) <= int(flags['orig_rev']):
         flags['can_write'] = True
     flags['to_write'].append(rev_seg)
-    rev_map[str(flags['orig_rev'])] = str(flags['renum_rev'])
+    map_revision(rev_map, flags['orig_rev'], flags['renum_rev'])
     if include and int(rev_seg.head[REV_NUM]) == 1:  # Revision 0 can't contain Node Records
         if add_dependents(flags['to_write'], check.matches, dump_version):
             flags['included'] = True
@@ -792,13 +1426,13 @@ def handle_exclude_to_include(node_seg, output_file, flags, opt, dump_version):
         flags['safe'] = False
         raise FinishedFiltering('Tangling is necessary')
     if not flags['warning_given']:
-        print('Warning: svnlook is required to pull missing files')
+        logger.warning('Warning: svnlook is required to pull missing files')
         flags['warning_given'] = True
     write_segments(output_file, flags['to_write'])
     if opt.renumber_revs and not flags['did_increment']:
         flags['renum_rev'] += 1
         flags['did_increment'] = True
-    flags['to_write'] = []  # Need to write items in queue because we know that this revision won't be empty
+    flags['to_write'] = deque()  # Need to write items in queue because we know that this revision won't be empty
     flags['untangled'] = True
     flags['included'] = False
     if node_seg.head[NODE_KIND] == 'file':
@@ -818,7 +1452,7 @@ def handle_include_to_exclude(output_file, flags, opt):
     if opt.renumber_revs and not flags['did_increment']:
         flags['renum_rev'] += 1
         flags['did_increment'] = True
-    flags['to_write'] = []
+    flags['to_write'] = deque()
     flags['included'] = False
 
 
@@ -846,7 +1480,7 @@ def update_to_empty_revision(flags, message):
         if kv[1].startswith('svn:date'):
             new_prop = flags['to_write'][0].order_prop[i:i + 2]
     flags['to_write'][0].update_new_props(new_prop)
-    message_len = len(message)
+    message_len = len(message.encode())
     flags['to_write'][0]._add_property('K 7\n', 'svn:log\n')
     flags['to_write'][0]._add_property('K {}\n'.format(message_len), '{}\n'.format(message))
 
@@ -862,28 +1496,45 @@ def write_included(rev_map, node_seg, flags, opt, untangled=False):
     """
     if opt.renumber_revs:
         if NODE_COPYFROM_REV in node_seg.head and not untangled:
-            orig_copy_rev = node_seg.head[NODE_COPYFROM_REV]
-            if isinstance(orig_copy_rev, int):
-                orig_copy_rev = str(orig_copy_rev)
-            new_copy_rev = rev_map[orig_copy_rev]
-            next = str(int(orig_copy_rev) + 1)
-            print('>>setting new_copy_rev: {0}'.format(new_copy_rev))
-            print('>>next: {0}'.format(next))
-            if int(new_copy_rev) == int(flags['renum_rev']) or (next in rev_map and int(new_copy_rev) == int(rev_map[next])):
-                new_copy_rev = str(int(new_copy_rev) - 1)
-                print('>>Updating new_copy_rev: {0}'.format(new_copy_rev))
+            orig_copy_rev = int(node_seg.head[NODE_COPYFROM_REV])
+            new_copy_rev = lookup_revision(rev_map, orig_copy_rev)
+            next = orig_copy_rev + 1
+            logger.debug('>>setting new_copy_rev: %s', new_copy_rev)
+            logger.debug('>>next: %s', next)
+            if new_copy_rev == flags['renum_rev'] or (next < len(rev_map) and new_copy_rev == lookup_revision(rev_map, next)):
+                new_copy_rev -= 1
+                logger.debug('>>Updating new_copy_rev: %s', new_copy_rev)
             node_seg.update_head(NODE_COPYFROM_REV, new_copy_rev)
     flags['to_write'].append(node_seg)
     flags['included'] = True
 
 
-def parse_dump(input_dump, output_dump, matches, include, opt):
+def commit_revision(output_file, rev_seg, flags, opt):
+    """
+    Writes out the queued records of a finished revision and advances the renumbered revision.
+
+    Revision 0 can't have any associated node records, it is written even when empty revisions are dropped.
+    """
+    keep = not opt.drop_empty or flags['included']
+    first = (opt.drop_empty or not flags['can_write']) and rev_seg and int(rev_seg.head[REV_NUM]) == 0
+    if first or (keep and flags['can_write']):
+        write_segments(output_file, flags['to_write'])
+    if keep and opt.renumber_revs and not flags['did_increment']:
+        flags['renum_rev'] += 1
+    if first:
+        flags['renum_rev'] += 1
+
+
+def parse_dump(input_dump, output_dump, matches, include, opt, check=None):
     """
     Handles the logic for parsing the input dumpfile and querying the repository
     to retrieve missing information.
 
     Revision map is present to map your renumbered revision to the actual revision.
     This is to adjust the 'Node-copyfrom-rev' when you renumber your revisions.
+
+    A matcher already built by create_matcher() can be passed as check, otherwise one is
+    built from matches, include and opt.
     """
 
     flags = {
@@ -895,130 +1546,109 @@ def parse_dump(input_dump, output_dump, matches, include, opt):
         'renum_rev': 0,                           # Renumbered revision number for output dump file
         'next_rev': None,                         # Stores an extracted revision record
         'did_increment': None,                    # Prevents multiple increments for 1 revision
-        'to_write': [],                           # List of items to write
+        'to_write': deque(),                      # Queue of items to write
         'included': False,                        # to_write list must be written
         'nodes_excluded': False,                  # indicates a node was excluded; used to compute empty revisions
     }
 
-    print('Starting to filter dumpfile : {} '.format(input_dump))
+    logger.info('Starting to filter dumpfile : %s ', input_dump)
     debug = opt.debug
-    rev_map = {}  # Stores the mappings for revisions when renumbering { 'original revision': 'renumbered revision' }
-    empty_revs = set()  # Stores dropped revisions numbers
-    check = create_matcher(include, matches, opt)
+    rev_map = array('Q')  # Stores the renumbered revision at the index of each original revision, REV_MAP_UNSET when not yet seen
+    empty_revs = BitSet()  # Stores dropped revisions numbers
+    start_rev_i = int(opt.start_revision) if opt.start_revision else None
+    if check is None:
+        check = create_matcher(include, matches, opt)
     if debug:
-        print('Match expression:\n{0}'.format(check))
+        logger.debug('Match expression:\n%s', check)
     if not opt.scan:
         clean_up(output_dump)
     else:
         output_dump = os.devnull
 
-    input_file = svndump_file(input_dump)
-    with open(output_dump, 'a+b') as output_file:
+    with open_svndump_file(input_dump) as input_file, open(output_dump, 'wb', buffering=OUTPUT_BUFFER_SIZE) as output_file:
         dump_version = write_dump_header(input_file, output_file, opt)
+        advise(output_file, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        released = {'input': 0, 'output': 0}  # Offsets up to which the page cache has been released
         try:
             while True:
+                release_page_cache(input_file, output_file, released)
                 if not opt.quiet:
-                    print('---- Working on Input Revision {} (Renumber Rev: {}) ----'.format(flags['orig_rev'], flags['renum_rev']))
-                flags['to_write'] = []
+                    logger.info('---- Working on Input Revision %s (Renumber Rev: %s) ----', flags['orig_rev'], flags['renum_rev'])
+                flags['to_write'] = deque()
                 flags['included'] = False
                 flags['nodes_excluded'] = False
                 if not flags['next_rev']:  # This is the first revision (rev 0).
                     rev_seg = Record(dump_format=dump_version)
                     rev_seg.extract_segment(input_file)
                     flags['to_write'].append(rev_seg)
+                    map_revision(rev_map, flags['orig_rev'], flags['renum_rev'])
                 else:
                     rev_seg = process_revision_record(rev_map, check, include, flags, opt, dump_version)
                 while True:
                     flags['did_increment'] = False  # Want to only increment once for each revision
+                    scanned = input_file.scan_record()
+                    if scanned is not None and NODE_PATH in scanned[0]:
+                        if not flags['can_write']:
+                            input_file.seek(scanned[1])
+                            continue
+                        if not check.is_included(scanned[0][NODE_PATH]):
+                            # Excluded node records are never written, so they are skipped without being extracted
+                            input_file.seek(scanned[1])
+                            flags['nodes_excluded'] = True
+                            continue
                     node_seg = Record(dump_format=dump_version)
                     node_seg.extract_segment(input_file)
                     if node_seg.type == 'Revision':
                         flags['next_rev'] = node_seg
                         break  # Finished processing node records and should now look at revision records.
-                    else:
-                        if flags['can_write']:
-                            if check.is_included(node_seg.head[NODE_PATH]):
-                                if opt.strip_merge:
-                                    to_strip = [i for i, v in enumerate(node_seg.order_prop) if v[1] == SVN_MERGEINFO]
-                                    for i in sorted(to_strip, reverse=True):
-                                        print('Stripping property: {}'.format(SVN_MERGEINFO.rstrip()))
-                                        # Strip key and value
-                                        del node_seg.order_prop[i:i+2]
-                                        # Recalculate Text and Prop content-length
-                                        update_prop_len(node_seg)
-                                if NODE_COPYFROM_REV in node_seg.head:
-                                    if (int(node_seg.head[NODE_COPYFROM_REV]) in empty_revs or
-                                            (opt.start_revision and int(node_seg.head[NODE_COPYFROM_REV]) < int(opt.start_revision)) or
-                                            (NODE_COPYFROM_REV in node_seg.head and not check.is_included(node_seg.head[NODE_COPYFROM_PATH]))):
-                                        if TEXT_CONTENT_LEN in node_seg.head and not (dump_version == 3 and TEXT_DELTA in node_seg.head):
-                                            print('{} with {}, no untangling is neccecary'.format(NODE_COPYFROM_REV, TEXT_CONTENT_LEN))
-                                            if debug:
-                                                print('Stripping: {0}'.format(node_seg.head[NODE_COPYFROM_REV]))
-                                                print('Stripping: {0}'.format(node_seg.head[NODE_COPYFROM_PATH]))
-                                            node_seg.order_head.remove((NODE_COPYFROM_REV, node_seg.head[NODE_COPYFROM_REV]))
-                                            node_seg.order_head.remove((NODE_COPYFROM_PATH, node_seg.head[NODE_COPYFROM_PATH]))
-                                            del node_seg.head[NODE_COPYFROM_REV]  # write_included() tests for this (opt.renumber_revs)
-                                            if TEXT_COPY_SOURCE_MD5 in node_seg.head:
-                                                if debug:
-                                                    print('Stripping: {0}'.format(node_seg.head[TEXT_COPY_SOURCE_MD5]))
-                                                node_seg.order_head.remove((TEXT_COPY_SOURCE_MD5, node_seg.head[TEXT_COPY_SOURCE_MD5]))
-                                            if TEXT_COPY_SOURCE_SHA1 in node_seg.head:
-                                                if debug:
-                                                    print('Stripping: {0}'.format(node_seg.head[TEXT_COPY_SOURCE_SHA1]))
-                                                node_seg.order_head.remove((TEXT_COPY_SOURCE_SHA1, node_seg.head[TEXT_COPY_SOURCE_SHA1]))
-                                            if dump_version == 3:
-                                                if TEXT_DELTA in node_seg.head:
-                                                    if debug:
-                                                        print('Stripping: {0}'.format(node_seg.head[TEXT_DELTA]))
-                                                    node_seg.order_head.remove((TEXT_DELTA, node_seg.head[TEXT_DELTA]))
-                                                if TEXT_DELTA_BASE_MD5 in node_seg.head:
-                                                    if debug:
-                                                        print('Stripping: {0}'.format(node_seg.head[TEXT_DELTA_BASE_MD5]))
-                                                    node_seg.order_head.remove((TEXT_DELTA_BASE_MD5, node_seg.head[TEXT_DELTA_BASE_MD5]))
-                                                if TEXT_DELTA_BASE_SHA1 in node_seg.head:
-                                                    if debug:
-                                                        print('Stripping: {0}'.format(node_seg.head[TEXT_DELTA_BASE_SHA1]))
-                                                    node_seg.order_head.remove((TEXT_DELTA_BASE_SHA1, node_seg.head[TEXT_DELTA_BASE_SHA1]))
-                                            write_included(rev_map, node_seg, flags, opt, untangled=True)
-                                        else:
-                                            print('{}: {} is in skipped revisions, trying to untangle'.
-                                                  format(NODE_COPYFROM_REV, node_seg.head[NODE_COPYFROM_REV]))
-                                            handle_exclude_to_include(node_seg, output_file, flags, opt, dump_version)
-                                    else:
-                                        write_included(rev_map, node_seg, flags, opt)
+                    else:  # An included node record
+                        if opt.strip_merge:
+                            to_strip = [i for i, v in enumerate(node_seg.order_prop) if v[1] == SVN_MERGEINFO]
+                            for i in sorted(to_strip, reverse=True):
+                                logger.info('Stripping property: %s', SVN_MERGEINFO.rstrip())
+                                # Strip key and value
+                                del node_seg.order_prop[i:i+2]
+                                # Recalculate Text and Prop content-length
+                                update_prop_len(node_seg)
+                        head = node_seg.head
+                        cp_rev = head.get(NODE_COPYFROM_REV)
+                        if cp_rev is not None:
+                            cp_rev_i = int(cp_rev)
+                            if (cp_rev_i in empty_revs or
+                                    (start_rev_i is not None and cp_rev_i < start_rev_i) or
+                                    not check.is_included(head[NODE_COPYFROM_PATH])):
+                                if TEXT_CONTENT_LEN in head and not (dump_version == 3 and TEXT_DELTA in head):
+                                    logger.info('%s with %s, no untangling is neccecary', NODE_COPYFROM_REV, TEXT_CONTENT_LEN)
+                                    strip_headers(node_seg, COPY_SOURCE_HEADERS[dump_version], debug)
+                                    write_included(rev_map, node_seg, flags, opt, untangled=True)
                                 else:
-                                    write_included(rev_map, node_seg, flags, opt)
+                                    logger.info('%s: %s is in skipped revisions, trying to untangle', NODE_COPYFROM_REV, cp_rev)
+                                    handle_exclude_to_include(node_seg, output_file, flags, opt, dump_version)
                             else:
-                                flags['nodes_excluded'] = True
+                                write_included(rev_map, node_seg, flags, opt)
+                        else:
+                            write_included(rev_map, node_seg, flags, opt)
 
                 if flags['nodes_excluded'] and opt.empty_rev_message is not None:
                     empty_revision = check_revision_empty(flags)
                     if empty_revision:
                         update_to_empty_revision(flags, opt.empty_rev_message)
                         if debug:
-                            print('Found revision made empty by node exclusions')
+                            logger.debug('Found revision made empty by node exclusions')
                 if flags['can_write'] and not flags['included']:
                     # Adding revision to skipped revs set unless untangled
                     if flags['untangled']:
                         # Reset flag
                         flags['untangled'] = False
                     else:
-                        print('Adding revision {} to the skipped revisions list'.format(flags['orig_rev']))  # [!!!]
+                        logger.info('Adding revision %s to the skipped revisions list', flags['orig_rev'])  # [!!!]
                         empty_revs.add(flags['orig_rev'])
-                if not opt.drop_empty or flags['included']:
-                    if flags['can_write']:
-                        write_segments(output_file, flags['to_write'])
-                    if opt.renumber_revs and not flags['did_increment']:
-                        flags['renum_rev'] += 1
-                if (opt.drop_empty or not flags['can_write']) and rev_seg and int(rev_seg.head[REV_NUM]) == 0:
-                    # Revision 0 can't have any associated node records.
-                    write_segments(output_file, flags['to_write'])
-                    flags['renum_rev'] += 1
+                commit_revision(output_file, rev_seg, flags, opt)
                 flags['orig_rev'] += 1
                 if debug:
-                    print('>>> Now at {0}:{1}'.format(flags['orig_rev'], flags['renum_rev']))
-                    print('>>> Flags setting')
-                    pprint.pprint(flags)
+                    # The queued records are left out, they can be large and are not useful here
+                    logger.debug('>>> Now at %s:%s flags=%r', flags['orig_rev'], flags['renum_rev'],
+                                 {key: value for key, value in flags.items() if key != 'to_write'})
         except FinishedFiltering:
             if not opt.scan:
                 if flags['nodes_excluded'] and opt.empty_rev_message is not None:
@@ -1026,12 +1656,26 @@ def parse_dump(input_dump, output_dump, matches, include, opt):
                     if empty_revision:
                         update_to_empty_revision(flags, opt.empty_rev_message)
                         if debug:
-                            print('Found revision made empty by node exclusions')
+                            logger.debug('Found revision made empty by node exclusions')
                 write_segments(output_file, flags['to_write'])
-                print('Filtering Complete : from {} to {}'.format(input_dump, output_dump))
+                logger.info('Filtering Complete : from %s to %s', input_dump, output_dump)
         print_scan_results(opt.scan, flags['safe'])
 
 
+def configure_logging(opt):
+    """
+    Sends log messages to stdout. Messages are held in a buffer and written out together, so logging
+    every revision does not cost a write per message. Warnings are written out straight away.
+    Returns the buffering handler so it can be flushed when filtering ends.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    buffered = MemoryHandler(LOG_BUFFER_RECORDS, flushLevel=logging.WARNING, target=handler)
+    logger.addHandler(buffered)
+    logger.setLevel(logging.DEBUG if opt.debug else logging.INFO)
+    return buffered
+
+
 def main():
 
     parser = ArgumentParser(
@@ -1073,6 +1717,9 @@ def main():
                         help='When specified and a revision is made empty by filtering, this becomes the revision message.'
                              ' This cannot be used with --keep-empty-revs.')
 
+    parser.add_argument('--svnlook-cache-bytes', dest='svnlook_cache_bytes', type=int, default=SVNLOOK_CACHE_BYTES,
+                        help='Maximum number of bytes of svnlook output kept for reuse when untangling. Use 0 to disable caching.')
+
     parser.add_argument('args', nargs=argparse_remainder)
 
     opt = parser.parse_args()
@@ -1105,7 +1752,12 @@ def main():
 
     matches = opt.args[2:]
 
-    parse_dump(input_dump, opt.output_dump, matches, include, opt)
+    svnlook_cache.max_bytes = opt.svnlook_cache_bytes
+    log_handler = configure_logging(opt)
+    try:
+        parse_dump(input_dump, opt.output_dump, matches, include, opt)
+    finally:
+        log_handler.flush()
 
 
 if __name__ == '__main__':
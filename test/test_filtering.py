@@ -1,10 +1,19 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from difflib import diff_bytes, unified_diff
+import filecmp
+import os
 from pathlib import Path, PurePath
+import shutil
 from tempfile import NamedTemporaryFile
+import threading
+import time
 import unittest
+from unittest import mock
 
-from ..svndumpfilter import parse_dump
+from .. import svndumpfilter
+from ..svndumpfilter import create_matcher, parse_dump
 
 
 class ParseDumpTestCase(unittest.TestCase):
@@ -25,6 +34,19 @@ class ParseDumpTestCase(unittest.TestCase):
     # Directory location of test dumpfiles and expected filtered dump files
     DUMPFILE_DIRECTORY = PurePath(Path(__file__).resolve().parent, 'data')
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._matcher_cache = {}
+
+    @classmethod
+    def get_matcher(cls, matches, include):
+        """ Return the path matcher for matches and include, building it on first use. """
+        key = (tuple(matches), include)
+        if key not in cls._matcher_cache:
+            cls._matcher_cache[key] = create_matcher(include, matches, cls.OPTIONS())
+        return cls._matcher_cache[key]
+
     def setUp(self):
         super().setUp()
         self.DEFAULT_OPTIONS = self.OPTIONS(True, True, False, False, None, False, None, '../repos/python', False)
@@ -32,21 +54,23 @@ class ParseDumpTestCase(unittest.TestCase):
     def filtered_dumpfile_differences(self, expected_dumpfile, filtered_dumpfile):
         """ Compute difference between the expected filtered dumpfile and the filtered dumpfile.
 
-            The dumpfiles are split based on newlines and differences are returned
+            The dumpfiles are read line by line and differences are returned
             as unified diffs
 
         """
-        expected_dumpfile_lines = open(expected_dumpfile, '+rb').read().split(b'\n')
-        filtered_dumpfile_lines = open(filtered_dumpfile, '+rb').read().split(b'\n')
+        if filecmp.cmp(expected_dumpfile, filtered_dumpfile, shallow=False):
+            return b''
+
+        with open(expected_dumpfile, 'rb') as expected, open(filtered_dumpfile, 'rb') as filtered:
+            expected_dumpfile_lines = list(expected)
+            filtered_dumpfile_lines = list(filtered)
 
         diff_generator = diff_bytes(unified_diff,
                                     expected_dumpfile_lines,
                                     filtered_dumpfile_lines,
                                     fromfile=b'Expected Filtered Dump',
                                     tofile=b'Actual Filtered Dump')
-        diff = b''
-        for diff_line in diff_generator:
-            diff += diff_line
+        diff = b''.join(diff_generator)
 
         return diff
 
@@ -57,7 +81,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt = self.OPTIONS()
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -69,7 +94,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt.drop_empty = False
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -82,7 +108,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt.renumber_revs = False
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -93,7 +120,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt = self.OPTIONS()
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -105,7 +133,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt.drop_empty = False
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -116,7 +145,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt = self.OPTIONS()
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/Makefile'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/Makefile'], False, opt,
+                       check=self.get_matcher(['python/trunk/Doc/Makefile'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -127,7 +157,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt = self.OPTIONS()
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/README'], True, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/README'], True, opt,
+                       check=self.get_matcher(['python/trunk/Doc/README'], True))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -140,7 +171,8 @@ class ParseDumpTestCase(unittest.TestCase):
         opt.renumber_revs = False
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['foo'], False, opt,
+                       check=self.get_matcher(['foo'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
@@ -151,10 +183,50 @@ class ParseDumpTestCase(unittest.TestCase):
         opt = self.OPTIONS()
 
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Include'], True, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Include'], True, opt,
+                       check=self.get_matcher(['python/trunk/Include'], True))
+            diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
+        self.assertEqual(b'', diff)
+
+    def test_large_binary_file_include_sendfile(self):
+        """ Test correctly including large files when every body is copied with sendfile() """
+        input_dumpfile = PurePath(self.DUMPFILE_DIRECTORY, 'test_include_large_file_dump')
+        expected_filtered_dumpfile = PurePath(self.DUMPFILE_DIRECTORY, 'expected_include_large_file_dump')
+        opt = self.OPTIONS()
+
+        with NamedTemporaryFile() as filtered_output_file, mock.patch.object(svndumpfilter, 'SENDFILE_MIN_BYTES', 0):
+            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Include'], True, opt,
+                       check=self.get_matcher(['python/trunk/Include'], True))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
 
+    def test_truncated_body(self):
+        """ Test that a dump file ending partway through a body is reported instead of writing a short body """
+        dump = Path(self.DUMPFILE_DIRECTORY, 'test_include_large_file_dump').read_bytes()
+        node = dump.index(b'Node-path: python/trunk/Lib/calendar.py\n')
+        body = dump.index(b'PROPS-END\n', node) + len(b'PROPS-END\n')
+        with NamedTemporaryFile() as input_dumpfile, NamedTemporaryFile() as filtered_output_file:
+            input_dumpfile.write(dump[:body + 6356 // 2])
+            input_dumpfile.flush()
+            with self.assertRaises(svndumpfilter.TruncatedDumpError):
+                parse_dump(input_dumpfile.name, filtered_output_file.name, ['python'], True, self.OPTIONS(),
+                           check=self.get_matcher(['python'], True))
+
+    def test_copy_past_end_of_file(self):
+        """ Test that copying a range running past the end of the dump file returns how many bytes were copied """
+        data = bytes(range(256)) * 4
+        with NamedTemporaryFile() as dumpfile:
+            dumpfile.write(data)
+            dumpfile.flush()
+            with svndumpfilter.open_svndump_file(dumpfile.name) as d_file:
+                if not d_file.random_access:
+                    self.skipTest('Ranges cannot be copied again from a pipe')
+                for sendfile_min_bytes in (0, svndumpfilter.SENDFILE_MIN_BYTES):
+                    with NamedTemporaryFile() as output_file, mock.patch.object(svndumpfilter, 'SENDFILE_MIN_BYTES', sendfile_min_bytes):
+                        self.assertEqual(d_file.copy_to(output_file, 1000, 100), len(data) - 1000)
+                        output_file.flush()
+                        self.assertEqual(Path(output_file.name).read_bytes(), data[1000:])
+
     def test_empty_revs_message(self):
         """ Test correctly filtering empty revs with a custom message """
         input_dumpfile = PurePath(self.DUMPFILE_DIRECTORY, 'test_nodes_empty_revs_dump')
@@ -165,6 +237,339 @@ class ParseDumpTestCase(unittest.TestCase):
         opt.renumber_revs = False
         opt.empty_rev_message = "This is an empty revision for padding."
         with NamedTemporaryFile() as filtered_output_file:
-            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/README'], False, opt)
+            parse_dump(input_dumpfile, filtered_output_file.name, ['python/trunk/Doc/README'], False, opt,
+                       check=self.get_matcher(['python/trunk/Doc/README'], False))
             diff = self.filtered_dumpfile_differences(expected_filtered_dumpfile, filtered_output_file.name)
         self.assertEqual(b'', diff)
+
+    def filter_copy_from(self, copyfrom_rev):
+        """ Filters a dump file whose only node copies from copyfrom_rev and returns the filtered dump file. """
+        revision = b'Revision-number: {0}\nProp-content-length: 10\nContent-length: 10\n\nPROPS-END\n\n'
+        node = ('Node-path: a\nNode-kind: dir\nNode-action: add\nNode-copyfrom-rev: {0}\nNode-copyfrom-path: a\n'
+                'Prop-content-length: 10\nContent-length: 10\n\nPROPS-END\n\n\n').format(copyfrom_rev).encode()
+        dump = (b'SVN-fs-dump-format-version: 2\n\nUUID: 1234-5678\n\n' + revision.replace(b'{0}', b'0') +
+                revision.replace(b'{0}', b'1') + node)
+        with NamedTemporaryFile() as input_dumpfile, NamedTemporaryFile() as filtered_output_file:
+            input_dumpfile.write(dump)
+            input_dumpfile.flush()
+            parse_dump(input_dumpfile.name, filtered_output_file.name, ['a'], True, self.OPTIONS())
+            return Path(filtered_output_file.name).read_bytes()
+
+    def test_copy_from_unread_revision(self):
+        """ Test that copying from a revision that was never read is reported instead of renumbered """
+        with self.assertRaises(svndumpfilter.UnknownRevisionError):
+            self.filter_copy_from(5)
+
+    def property_block(self, props):
+        """ Returns the property section holding the properties, given as (key, value) strings. """
+        block = b''
+        for key, value in props:
+            for letter, text in (('K', key), ('V', value)):
+                text = text.encode()
+                block += '{0} {1}\n'.format(letter, len(text)).encode() + text + b'\n'
+        return block + b'PROPS-END\n'
+
+    def assert_property_lengths(self, dumpfile):
+        """ Checks that the properties of each record fill exactly its Prop-content-length and the lengths they give. """
+        with svndumpfilter.open_svndump_file(dumpfile) as d_file:
+            svndumpfilter.DumpHeader().extract_dump_header(d_file)
+            while d_file.skip_separators():
+                head, end = d_file.scan_record()
+                d_file.readline_bytes()
+                while d_file.readline_bytes() != b'\n':
+                    pass
+                if svndumpfilter.PROP_CONTENT_LEN in head:
+                    block = d_file.read(int(head[svndumpfilter.PROP_CONTENT_LEN]))
+                    self.assertTrue(block.endswith(b'PROPS-END\n'), head)
+                    pos = 0
+                    while block[pos:] != b'PROPS-END\n':
+                        newline = block.index(b'\n', pos)
+                        length = int(block[pos + 2:newline])
+                        self.assertEqual(block[newline + 1 + length:newline + 2 + length], b'\n', head)
+                        pos = newline + 2 + length
+                d_file.seek(end)
+
+    def test_non_ascii_property_lengths(self):
+        """ Test that recomputed property lengths count bytes for non-ASCII properties and empty revision messages """
+        date = ('svn:date', '2024-01-01T00:00:00.000000Z')
+        dump = b'SVN-fs-dump-format-version: 2\n\nUUID: 1234-5678\n\n'
+        for rev, node, props in ((0, None, [date]),
+                                 (1, 'a', [('svn:mergeinfo', '/b:1'), ('description', 'caf\u00e9 \u2713')]),
+                                 (2, 'b', [])):
+            block = self.property_block([date, ('svn:log', 'r\u00e9vision {0}'.format(rev))])
+            dump += 'Revision-number: {0}\nProp-content-length: {1}\nContent-length: {1}\n\n'.format(rev, len(block)).encode()
+            dump += block + b'\n'
+            if node:
+                block = self.property_block(props)
+                dump += ('Node-path: {0}\nNode-kind: dir\nNode-action: add\nProp-content-length: {1}\nContent-length: {1}\n\n'
+                         .format(node, len(block)).encode() + block + b'\n\n')
+        opt = self.OPTIONS()
+        opt.drop_empty = False
+        opt.renumber_revs = False
+        opt.strip_merge = True
+        opt.empty_rev_message = 'R\u00e9vision vide \u2713'
+
+        with NamedTemporaryFile() as input_dumpfile, NamedTemporaryFile() as filtered_output_file:
+            input_dumpfile.write(dump)
+            input_dumpfile.flush()
+            parse_dump(input_dumpfile.name, filtered_output_file.name, ['a'], True, opt)
+            filtered = Path(filtered_output_file.name).read_bytes()
+            self.assert_property_lengths(filtered_output_file.name)
+        self.assertNotIn(b'svn:mergeinfo', filtered)
+        self.assertIn('caf\u00e9 \u2713'.encode(), filtered)
+        self.assertIn('R\u00e9vision vide \u2713'.encode(), filtered)
+
+
+class RecordTestCase(unittest.TestCase):
+
+    DUMPFILE_DIRECTORY = ParseDumpTestCase.DUMPFILE_DIRECTORY
+
+    def extract_records(self, dumpfile):
+        """ Yields each record of the dump file with the mapping it was read from. """
+        with svndumpfilter.open_svndump_file(str(dumpfile)) as d_file:
+            svndumpfilter.DumpHeader().extract_dump_header(d_file)
+            while True:
+                record = svndumpfilter.Record()
+                try:
+                    record.extract_segment(d_file)
+                except svndumpfilter.FinishedFiltering:
+                    return
+                yield record, d_file.mm
+
+    def raw_bytes(self, record, mm):
+        """ Returns what writing the record straight from the input dump file writes before its body. """
+        _, offset, length = record.raw_ref
+        end_prop = bytearray()
+        record._write_end_prop(end_prop)
+        return mm[offset:offset + length] + end_prop
+
+    def test_raw_records_match_serialized(self):
+        """ Test that records written straight from the input match serializing them, for every test dump file """
+        raw_records = 0
+        for dumpfile in sorted(Path(self.DUMPFILE_DIRECTORY).glob('*_dump')):
+            for record, mm in self.extract_records(dumpfile):
+                if record.raw_ref is not None:
+                    raw_records += 1
+                    self.assertEqual(self.raw_bytes(record, mm), record.serialize(), '{0}: {1}'.format(dumpfile.name, record.head))
+        self.assertGreater(raw_records, 500)
+
+    def test_records_not_written_raw(self):
+        """ Test that deleted nodes and properties without PROPS-END are serialized instead of written raw """
+        dump = (b'SVN-fs-dump-format-version: 2\n\nUUID: 1234-5678\n\n'
+                b'Node-path: deleted\nNode-action: delete\nProp-content-length: 10\nContent-length: 10\n\nPROPS-END\n\n'
+                b'Node-path: unterminated\nNode-kind: file\nNode-action: change\nProp-content-length: 14\nContent-length: 14\n\n'
+                b'K 1\na\nV 1\nb\n\n\n'
+                b'Node-path: kept\nNode-kind: dir\nNode-action: add\nProp-content-length: 10\nContent-length: 10\n\nPROPS-END\n\n\n')
+        with NamedTemporaryFile() as dumpfile:
+            dumpfile.write(dump)
+            dumpfile.flush()
+            records = {}
+            for record, mm in self.extract_records(dumpfile.name):
+                records[record.head['Node-path']] = record
+                if record.raw_ref is not None:
+                    self.assertEqual(self.raw_bytes(record, mm), record.serialize())
+        self.assertIsNone(records['deleted'].raw_ref)
+        self.assertIsNone(records['unterminated'].raw_ref)
+        self.assertIsNotNone(records['kept'].raw_ref)
+
+
+class RevisionMapTestCase(unittest.TestCase):
+
+    def test_lookup_mapped_revisions(self):
+        """ Test that mapped revisions, including revision 0, are looked up """
+        rev_map = array('Q')
+        svndumpfilter.map_revision(rev_map, 0, 0)
+        svndumpfilter.map_revision(rev_map, 1, 1)
+        svndumpfilter.map_revision(rev_map, 2, 1)
+        self.assertEqual([svndumpfilter.lookup_revision(rev_map, rev) for rev in range(3)], [0, 1, 1])
+
+    def test_lookup_unmapped_revisions(self):
+        """ Test that revisions never mapped or past the end of the map are reported """
+        rev_map = array('Q')
+        svndumpfilter.map_revision(rev_map, 2, 1)
+        for rev in (0, 1, 3, -1):
+            with self.assertRaises(svndumpfilter.UnknownRevisionError):
+                svndumpfilter.lookup_revision(rev_map, rev)
+
+
+class SVNLookCacheTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        """ Test that the oldest entries are evicted once the byte budget is exceeded """
+        cache = svndumpfilter.SVNLookCache(10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.put('c', b'1234')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'1234')
+        self.assertEqual(cache.get('c'), b'1234')
+        self.assertEqual(cache.size, 8)
+
+    def test_get_refreshes_entry(self):
+        """ Test that reading an entry keeps it over entries read less recently """
+        cache = svndumpfilter.SVNLookCache(10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        self.assertEqual(cache.get('a'), b'1234')
+        cache.put('c', b'1234')
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertIsNone(cache.get('b'))
+
+    def test_entry_over_budget_not_cached(self):
+        """ Test that output larger than the whole budget is not cached and evicts nothing """
+        cache = svndumpfilter.SVNLookCache(10)
+        cache.put('a', b'1234')
+        cache.put('b', b'12345678901')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertEqual(cache.size, 4)
+
+    def test_cached_key_not_readded(self):
+        """ Test that caching a key again keeps the first output and its size """
+        cache = svndumpfilter.SVNLookCache(10)
+        cache.put('a', b'1234')
+        cache.put('a', b'123456')
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertEqual(cache.size, 4)
+
+
+class MissingDirectoryTestCase(unittest.TestCase):
+
+    WORKERS = 2
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.written = []
+        self.max_pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=self.WORKERS)
+        self.addCleanup(self.executor.shutdown)
+        patches = [
+            mock.patch.object(svndumpfilter, 'SVNLOOK_WORKERS', self.WORKERS),
+            mock.patch.object(svndumpfilter, 'get_svnlook_executor', return_value=self),
+            mock.patch.object(svndumpfilter, 'run_svnlook_command', side_effect=self.run_svnlook_command),
+            mock.patch.object(svndumpfilter, 'add_dir_to_dump', side_effect=self.add_dir_to_dump),
+            mock.patch.object(svndumpfilter, 'add_file_to_dump', side_effect=self.add_file_to_dump),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.submitted += 1
+            self.max_pending = max(self.max_pending, self.submitted - self.files_written())
+        return self.executor.submit(fn, *args)
+
+    def files_written(self):
+        return sum(1 for _, body in self.written if body is not None)
+
+    def run_svnlook_command(self, command, rev_num, repo_path, file_path, filtering, debug):
+        if command == 'tree':
+            return b'\n'.join(line.encode() for line in self.tree) + b'\n'
+        index = self.tree.index(file_path)
+        time.sleep(0.001 * (len(self.tree) - index))  # Earlier files finish last
+        return file_path.encode()
+
+    def add_dir_to_dump(self, d_file, destination, dump_version):
+        with self.lock:
+            self.written.append((destination, None))
+
+    def add_file_to_dump(self, d_file, destination, dump_version, file_body):
+        with self.lock:
+            self.written.append((destination, file_body))
+
+    def test_records_written_in_tree_order(self):
+        """ Test that records are written in svnlook tree order with a bounded number of file contents pending """
+        self.tree = ['from/a', 'from/b', 'from/sub/', 'from/sub/c', 'from/sub/d', 'from/e', 'from/f', 'from/g', 'from/sub2/', 'from/h']
+        svndumpfilter.handle_missing_directory(None, 'from', 'to', 5, '/repo', 3, False)
+        expected = [(path.replace('from', 'to', 1), None if path.endswith('/') else path.encode()) for path in self.tree]
+        self.assertEqual(self.written, expected)
+        self.assertEqual(self.submitted, 8)
+        self.assertLessEqual(self.max_pending, 2 * self.WORKERS)
+
+
+class BitSetTestCase(unittest.TestCase):
+
+    def test_add_across_byte_boundaries(self):
+        """ Test that numbers on either side of a byte boundary are stored in their own bits """
+        bit_set = svndumpfilter.BitSet()
+        for number in (7, 8, 15, 16):
+            bit_set.add(number)
+        self.assertEqual([number for number in range(24) if number in bit_set], [7, 8, 15, 16])
+        self.assertEqual(bit_set.bits, bytearray([0x80, 0x81, 0x01]))
+
+    def test_grows_from_empty(self):
+        """ Test that the set grows just enough to hold the largest number added """
+        bit_set = svndumpfilter.BitSet()
+        self.assertNotIn(0, bit_set)
+        bit_set.add(0)
+        self.assertEqual(len(bit_set.bits), 1)
+        bit_set.add(100)
+        self.assertEqual(len(bit_set.bits), 13)
+        self.assertIn(0, bit_set)
+        self.assertIn(100, bit_set)
+
+    def test_numbers_past_end(self):
+        """ Test that numbers past the end of the array are not in the set and do not grow it """
+        bit_set = svndumpfilter.BitSet()
+        bit_set.add(3)
+        for number in (8, 1000, 1 << 40):
+            self.assertNotIn(number, bit_set)
+        self.assertEqual(len(bit_set.bits), 1)
+
+
+class StreamParseDumpTestCase(ParseDumpTestCase):
+    """ Runs the filtering tests with each input dump file read through a buffer smaller than its lines and bodies. """
+
+    BUFFER_SIZE = 7
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(svndumpfilter, 'open_svndump_file',
+                                    lambda dumpfilename: svndumpfilter.svndump_stream_file(dumpfilename, buf_size=self.BUFFER_SIZE))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_long_line_and_body(self):
+        """ Test reading a header line and a body that are both longer than the read buffer """
+        header = b'Node-path: ' + b'd' * (self.BUFFER_SIZE * 5) + b'\n'
+        body = bytes(range(256)) * 3
+        with NamedTemporaryFile() as dumpfile:
+            dumpfile.write(header + body + b'no newline at the end')
+            dumpfile.flush()
+            with svndumpfilter.open_svndump_file(dumpfile.name) as d_file:
+                self.assertEqual(d_file.readline_bytes(), header)
+                self.assertEqual(d_file.read(len(body)), body)
+                self.assertEqual(d_file.tell(), len(header) + len(body))
+                self.assertEqual(d_file.readline_bytes(), b'no newline at the end\n')
+                self.assertEqual(d_file.readline_bytes(), b'')
+
+
+@unittest.skipUnless(os.path.isdir('/dev/fd'), 'Pipes are opened through /dev/fd')
+class PipeParseDumpTestCase(ParseDumpTestCase):
+    """ Runs the filtering tests with each input dump file read from a pipe, which cannot seek. """
+
+    def setUp(self):
+        super().setUp()
+        self.open_svndump_file = svndumpfilter.open_svndump_file
+        patcher = mock.patch.object(svndumpfilter, 'open_svndump_file', self.open_through_pipe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_through_pipe(self, dumpfilename):
+        """ Opens the read end of a pipe that the dump file is written to from another thread. """
+        read_fd, write_fd = os.pipe()
+
+        def feed():
+            try:
+                with open(write_fd, 'wb') as pipe, open(dumpfilename, 'rb') as d_file:
+                    shutil.copyfileobj(d_file, pipe)
+            except BrokenPipeError:
+                pass  # The test stopped reading early
+
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        self.addCleanup(feeder.join)
+        self.addCleanup(os.close, read_fd)
+        return self.open_svndump_file('/dev/fd/{0}'.format(read_fd))
@@ -0,0 +1,148 @@
+import io
+import mmap
+import os
+import shutil
+from tempfile import TemporaryDirectory, TemporaryFile
+from pathlib import Path, PurePath
+import unittest
+from unittest import mock
+
+from .. import getrev
+from ..getrev import find_revision, find_revision_indexed, read_revision, write_revision
+
+
+class FindRevisionTestCase(unittest.TestCase):
+
+    # Directory location of test dumpfiles
+    DUMPFILE_DIRECTORY = PurePath(Path(__file__).resolve().parent, 'data')
+
+    def extract(self, dumpfile, revision):
+        """
+        Returns the bytes of the revision record found in the dump file, or None.
+        """
+        with open(PurePath(self.DUMPFILE_DIRECTORY, dumpfile), 'rb') as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                location = find_revision(mm, revision)
+                if location is None:
+                    return None
+                start, end = location
+                return mm[start:end]
+
+    def test_first_revision(self):
+        """
+        Revision 0 follows the dump header and ends at the next revision record.
+        """
+        record = self.extract('test_empty_revs_dump', 0)
+        self.assertTrue(record.startswith(b'Revision-number: 0\n'))
+        self.assertTrue(record.endswith(b'* Dumped revision 0.\n'))
+
+    def test_last_revision(self):
+        """
+        The last revision record runs to the end of the dump file.
+        """
+        record = self.extract('test_nodes_empty_revs_dump', 2162)
+        with open(PurePath(self.DUMPFILE_DIRECTORY, 'test_nodes_empty_revs_dump'), 'rb') as fd:
+            self.assertTrue(fd.read().endswith(record))
+        self.assertTrue(record.startswith(b'Revision-number: 2162\n'))
+
+    def test_revision_is_not_a_prefix_match(self):
+        """
+        Revision 2 must not match Revision-number: 2157.
+        """
+        self.assertIsNone(self.extract('test_nodes_empty_revs_dump', 2))
+
+    def test_binary_content(self):
+        """
+        Records holding binary content are returned intact.
+        """
+        record = self.extract('test_include_large_file_dump', 2166)
+        self.assertTrue(record.startswith(b'Revision-number: 2166\n'))
+        self.assertNotIn(b'\nRevision-number: ', record)
+        self.assertGreater(len(record), 100000)
+
+    def test_read_revision_matches_find_revision(self):
+        """
+        Reading a dump file that cannot be mapped yields the same records as the mapped scan.
+        """
+        with open(PurePath(self.DUMPFILE_DIRECTORY, 'test_include_large_file_dump'), 'rb') as fd:
+            contents = fd.read()
+        for revision in (2166, 2167):
+            out = io.BytesIO()
+            self.assertTrue(read_revision(io.BytesIO(contents), revision, out))
+            self.assertEqual(out.getvalue(), self.extract('test_include_large_file_dump', revision))
+        out = io.BytesIO()
+        self.assertFalse(read_revision(io.BytesIO(contents), 3, out))
+        self.assertEqual(out.getvalue(), b'')
+
+    def test_read_revision_across_chunks(self):
+        """
+        A revision header split across two scan chunks is still found.
+        """
+        with open(PurePath(self.DUMPFILE_DIRECTORY, 'test_nodes_empty_revs_dump'), 'rb') as fd:
+            contents = fd.read()
+        with mock.patch.object(getrev, 'SCAN_CHUNK_SIZE', 7):
+            for revision in (2157, 2160, 2162):
+                out = io.BytesIO()
+                self.assertTrue(read_revision(io.BytesIO(contents), revision, out))
+                self.assertEqual(out.getvalue(), self.extract('test_nodes_empty_revs_dump', revision))
+
+    def test_indexed_lookup_matches_scan(self):
+        """
+        The indexed lookup finds the same records as the scan and builds the index on first use.
+        """
+        with TemporaryDirectory() as temp_dir:
+            dumpfile = str(PurePath(temp_dir, 'test_nodes_empty_revs_dump'))
+            shutil.copyfile(PurePath(self.DUMPFILE_DIRECTORY, 'test_nodes_empty_revs_dump'), dumpfile)
+            with open(dumpfile, 'rb') as fd:
+                with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for revision in (2157, 2159, 2162, 2):
+                        self.assertEqual(find_revision_indexed(mm, revision, dumpfile), find_revision(mm, revision))
+            self.assertTrue(Path(dumpfile + '.ridx').exists())
+
+    def test_stale_index_rebuilt(self):
+        """
+        An index built from another dump file is not trusted when the dump file replacing it kept an older
+        modification time, whether or not the two dump files are the same size.
+        """
+        with TemporaryDirectory() as temp_dir:
+            dumpfile = str(PurePath(temp_dir, 'test_nodes_empty_revs_dump'))
+            contents = Path(self.DUMPFILE_DIRECTORY, 'test_nodes_empty_revs_dump').read_bytes()
+            Path(dumpfile).write_bytes(contents)
+            with open(dumpfile, 'rb') as fd:
+                with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    find_revision_indexed(mm, 2157, dumpfile)
+            # Every record moved by a byte, then a different dump file altogether
+            for replacement in (b'\n' + contents[:-1], Path(self.DUMPFILE_DIRECTORY, 'test_empty_revs_dump').read_bytes()):
+                Path(dumpfile).write_bytes(replacement)
+                index_mtime = os.path.getmtime(dumpfile + '.ridx')
+                os.utime(dumpfile, (index_mtime - 60, index_mtime - 60))
+                with open(dumpfile, 'rb') as fd:
+                    with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        for revision in (2, 2158):
+                            self.assertEqual(find_revision_indexed(mm, revision, dumpfile), find_revision(mm, revision))
+
+    def test_bisected_lookup_matches_scan(self):
+        """
+        Bisecting with a small window finds the same records as scanning the whole file.
+        """
+        for revision in (0, 1, 50, 99, 100):
+            expected = self.extract('test_empty_revs_dump', revision)
+            with mock.patch.object(getrev, 'BISECT_WINDOW', 64):
+                self.assertEqual(self.extract('test_empty_revs_dump', revision), expected)
+            self.assertTrue(expected.startswith('Revision-number: {0}\n'.format(revision).encode()))
+
+    def test_write_revision(self):
+        """
+        The record is written the same way to a real file and to an in-memory stream.
+        """
+        expected = self.extract('test_include_large_file_dump', 2166)
+        with open(PurePath(self.DUMPFILE_DIRECTORY, 'test_include_large_file_dump'), 'rb') as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start, end = find_revision(mm, 2166)
+                with TemporaryFile() as out:
+                    write_revision(fd, mm, start, end, out)
+                    out.seek(0)
+                    self.assertEqual(out.read(), expected)
+                out = io.BytesIO()
+                write_revision(fd, mm, start, end, out)
+                self.assertEqual(out.getvalue(), expected)
@@ -1,5 +1,7 @@
 import unittest
+from unittest import mock
 
+from .. import svndumpfilter
 from ..svndumpfilter import MatchFiles, add_dependents
 
 
@@ -17,6 +19,7 @@ class PathMethodTestCase(unittest.TestCase):
             check.add_to_matches(item)
         for path, result in iter(expected.items()):
             self.assertEqual(check.is_included(path), result)
+            self.assertEqual(check.is_included(path.encode()), result)
         return True
 
     def path_match_include(self, expected, included):
@@ -28,6 +31,7 @@ class PathMethodTestCase(unittest.TestCase):
             check.add_to_matches(item)
         for path, result in iter(expected.items()):
             self.assertEqual(check.is_included(path), result)
+            self.assertEqual(check.is_included(path.encode()), result)
 
     def test_path_include_1(self):
         """
@@ -69,6 +73,34 @@ class PathMethodTestCase(unittest.TestCase):
         excluded = ["foo/bar"]
         self.path_match_exclude(expected, excluded)
 
+    def test_path_match_trie(self):
+        """
+        Tests that walking the trie of the matches agrees with comparing each match.
+        """
+        expected = {"foon": False, "foo": False, "foo/boon": False, "foo/boon/file1.txt": False,
+                    "foo/bar": True, "foo/bar/file1.txt": True, "foon/bar": False,
+                    "include_me": True, "include_me/file1.txt": True, "include_me/": True, "bar": False}
+        with mock.patch.object(svndumpfilter, 'MATCH_TRIE_THRESHOLD', 0):
+            self.path_match_include(expected, ["foo/bar", "include_me/"])
+            self.path_match_exclude({path: not result for path, result in expected.items()}, ["foo/bar", "include_me/"])
+
+    def test_path_match_no_matches(self):
+        """
+        Tests that nothing is included without include matches and everything is included without exclude matches.
+        """
+        self.path_match_include({"foo": False, "foo/bar": False}, [])
+        self.path_match_exclude({"foo": True, "foo/bar": True}, [])
+
+    def test_path_match_after_adding(self):
+        """
+        Tests that a path looked up before a match is added is looked up again afterwards.
+        """
+        check = MatchFiles(True)
+        check.add_to_matches("foo")
+        self.assertFalse(check.is_included("bar/file1.txt"))
+        check.add_to_matches("bar")
+        self.assertTrue(check.is_included("bar/file1.txt"))
+
     def test_add_dependents_1(self):
         """
         Path coconut/branches is added.
@@ -102,6 +134,7 @@ class PathMethodTestCase(unittest.TestCase):
         Path test/testme/test3 is added.
         Path test is added.
         Path whoop/whoo/woon is added.
+        Path whoop/whoo/woon/ is added again and adds no duplicates.
         """
         for dump_version in DUMP_VERSIONS:
             check = MatchFiles(True)
@@ -110,8 +143,9 @@ class PathMethodTestCase(unittest.TestCase):
             check.add_to_matches("test/testme/test3")
             check.add_to_matches("test")
             check.add_to_matches("whoop/whoo/woon")
+            check.add_to_matches("whoop/whoo/woon/")
             to_write = []
             add_dependents(to_write, check.matches, dump_version)
             actual_paths = [node.head["Node-path"] for node in to_write]
             expected_paths = ["whoop", "coconut", "whoop/whoo"]
-            self.assertEqual(set(actual_paths), set(expected_paths))
+            self.assertEqual(sorted(actual_paths), sorted(expected_paths))